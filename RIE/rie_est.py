@@ -21,28 +21,44 @@ def returnsStandardization(returns):
 # The returns should be a Dataframe of size T X N without NULL values
 
 
-def get_rie(E, normalize=False, max_ones = True):
-    def get_s_k(index_lambda, N):
-        return 1/N * (sum(1/(z_k[index_lambda] - lambdas)) - 1/(z_k[index_lambda] - lambdas[index_lambda]))
+# harcoded number of ticks we have per day approximately
+DEFAULT_T = 2500
+# number of complex entries of the eigenvalue differences held at once by get_rie
+MAX_CHUNK_ELEMENTS = 2**22
 
-    # # T is the number of observations, N is the number of assets
-    
-    T = 2500 #harcoded number of ticks we have per day approximately
-    N = E.shape[0]
-    RIE_estimator = np.zeros((N, N), dtype=float)
-        
-    # The eigenvalues and eigenvectors of the returns are obtained
+
+def get_rie(E, normalize=False, max_ones=True, T=DEFAULT_T, chunk_size=None):
+    # E is a N X N matrix or a stack of them (days X N X N), T the number of observations behind each matrix: a
+    # number, or an array with one value per matrix. The matrices are processed chunk_size at a time to bound memory.
+    E = np.asarray(E, dtype=float)
+    single = E.ndim == 2
+    E = E[None] if single else E
+    days, N = E.shape[0], E.shape[1]
+    T = np.broadcast_to(np.asarray(T, dtype=float), (days,))
+    if chunk_size is None:
+        chunk_size = max(1, MAX_CHUNK_ELEMENTS // (N * N))
+
+    RIE_estimator = np.empty_like(E)
+    for start in range(0, days, chunk_size):
+        stop = min(start + chunk_size, days)
+        RIE_estimator[start:stop] = _rie_chunk(E[start:stop], T[start:stop], max_ones)
+    return RIE_estimator[0] if single else RIE_estimator
+
+
+def _rie_chunk(E, T, max_ones):
+    N = E.shape[1]
+    # The eigenvalues (ascending) and eigenvectors (columns) of the returns are obtained
     lambdas, u_ks = LA.eigh(E)
-    u_ks = u_ks.T
-    n_lambda = lambdas[0]
-    q = float(N/T)
-    sigma_sq = (n_lambda)/(1 - np.sqrt(q))**2
-    lambda_plus = n_lambda*((1+np.sqrt(q))/(1 - np.sqrt(q)))**2
+    n_lambda = lambdas[:, :1]
+    q = (N / T)[:, None]
+    sigma_sq = n_lambda / (1 - np.sqrt(q))**2
+    lambda_plus = n_lambda * ((1 + np.sqrt(q)) / (1 - np.sqrt(q)))**2
     # Get z_k
     z_k = lambdas - (1j / np.sqrt(N))
-    # Get s_k(z_k)
-    s_k = list(map(lambda index_lambda: get_s_k(
-        index_lambda, N), np.argsort(lambdas)))
+    # Get s_k(z_k), leaving out the term of lambda_k
+    inv_diff = 1 / (z_k[:, :, None] - lambdas[:, None, :])
+    s_k = 1/N * (inv_diff.sum(axis=2) - 1/(z_k - lambdas))
+    del inv_diff
     # Get \xi_k^{RIE}
     xi_k = lambdas / np.abs(1 - q + q * z_k * s_k)**2
     # Get stieltjes g_{mp}(z)
@@ -51,14 +67,13 @@ def get_rie(E, normalize=False, max_ones = True):
     # Get gamma_k(z_k)
     gamma_k = sigma_sq * ((np.abs(1 - q + q*z_k*g_mp)**2)/(lambdas))
     # Get \hat{xh}_k
-    xi_hat = list(map(lambda xi, gamma: xi *
-                  gamma if gamma > 1 else xi, xi_k, gamma_k))
+    xi_hat = np.where(gamma_k > 1, xi_k * gamma_k, xi_k)
     # Get RIE
-    for xi, u_i in zip(xi_hat, u_ks):
-        RIE_estimator += xi*(u_i.reshape(-1, 1) @ u_i.reshape(-1, 1).T)
-    
+    RIE_estimator = (u_ks * xi_hat[:, None, :]) @ u_ks.transpose(0, 2, 1)
+
     if max_ones:
-        np.fill_diagonal(RIE_estimator, 1)
-        RIE_estimator[RIE_estimator >1] = 1
+        diagonal = np.arange(N)
+        RIE_estimator[:, diagonal, diagonal] = 1
+        RIE_estimator[RIE_estimator > 1] = 1
 
     return RIE_estimator
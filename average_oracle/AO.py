@@ -17,6 +17,30 @@ def get_sortest_eig(C):
     return l, v
 
 
+def rolling_mean(stack: np.ndarray, window: int) -> np.ndarray:
+    """
+    Means of every `window` consecutive matrices of a stack, from one cumulative sum instead of one mean per day.
+    Non-finite entries are left out of the sum and counted in a second cumulative sum, so that, as with a mean per
+    window, only the windows containing them are NaN. The difference of two cumulative sums carries a rounding error
+    relative to the sum of all the previous days rather than to the window, about days / window * 1e-16 of the mean,
+    e.g. 1e-14 for 20 years of days averaged over a month.
+    Args:
+       stack (ndarray): The matrices stacked along the first axis (days, N, N).
+       window (int): The number of days averaged.
+    Returns:
+        ndarray : The stack of means (days - window + 1, N, N), where entry k averages the days k to k + window - 1.
+    """
+    finite = np.isfinite(stack)
+    cumsum = np.zeros((stack.shape[0] + 1,) + stack.shape[1:])
+    np.cumsum(np.where(finite, stack, 0), axis=0, out=cumsum[1:])
+    means = (cumsum[window:] - cumsum[:-window]) / window
+    if not finite.all():
+        missing = np.zeros(cumsum.shape, dtype=np.int64)
+        np.cumsum(~finite, axis=0, out=missing[1:])
+        means[missing[window:] != missing[:-window]] = np.nan
+    return means
+
+
 class AO():
     def __init__(self, AO_values_path: str) -> None:
         """
@@ -37,7 +61,7 @@ class AO():
             ndarray : The filtered correlation matrix.
         """
         l, v = get_sortest_eig(C)
-        C_AO = (v @ np.diag(self.AO_values) @ v.T)
+        C_AO = (v * self.AO_values) @ v.T
 
         return C_AO
 
@@ -57,3 +81,40 @@ class AO():
         Sigma_AO = C_AO * si_sj
 
         return Sigma_AO
+
+    def filter_correlation_AO_batch(self, C: np.ndarray) -> np.ndarray:
+        """
+        Filter a stack of correlation matrices at once and return it.
+        Args:
+           C (ndarray): The correlations to filter, stacked as (days, N, N).
+        Returns:
+            ndarray : The filtered correlation matrices (days, N, N).
+        """
+        # eigh sorts the eigenvalues of every matrix in ascending order, as get_sortest_eig
+        _, v = np.linalg.eigh(C)
+        return (v * self.AO_values) @ v.transpose(0, 2, 1)
+
+    def filter_covariance_AO_batch(self, Sigma: np.ndarray) -> np.ndarray:
+        """
+        Filter a stack of covariance matrices at once and return it.
+        Args:
+           Sigma (ndarray): The covariances to filter, stacked as (days, N, N).
+        Returns:
+            ndarray : The filtered covariance matrices (days, N, N).
+        """
+        s = np.sqrt(np.diagonal(Sigma, axis1=1, axis2=2))
+        si_sj = s[:, :, None] * s[:, None, :]
+        return self.filter_correlation_AO_batch(Sigma / si_sj) * si_sj
+
+    def filter_rolling_covariance_AO(self, Sigma: np.ndarray, window: int) -> np.ndarray:
+        """
+        Filter the mean covariance of every window of `window` consecutive days and return them.
+        Args:
+           Sigma (ndarray): The daily covariances, stacked as (days, N, N). A (N, N, days) array such as var_cov in
+               the notebook is converted with np.moveaxis(var_cov, 2, 0).
+           window (int): The number of days averaged before filtering.
+        Returns:
+            ndarray : The filtered covariance matrices (days - window + 1, N, N), where entry k is the filtered mean of
+                the days k to k + window - 1.
+        """
+        return self.filter_covariance_AO_batch(rolling_mean(Sigma, window))
@@ -1 +1,5 @@
-from bahc_1_9_tick_cov.main import filterCovariance
+from bahc_1_9_tick_cov.main import filterCovariance, filterCovarianceSweep
+from bahc_1_9_tick_cov.hayashi_yoshida import covariance_matrix_Hayashi_Yoshida, rolling_covariances_Hayashi_Yoshida
+from bahc_1_9_tick_cov.parallel import filterCovarianceWindows
+from bahc_1_9_tick_cov.nearest import NearestPSD, nearest_psd
+from bahc_1_9_tick_cov.online import OnlineHayashiYoshida, FilteredView
@@ -0,0 +1,219 @@
+import numpy as np
+import pandas as pd
+
+
+def _to_arrays(x):
+    '''
+    Split a list of log return frames into sorted int64 nanosecond timestamps and 2d float values.
+    Returns sharing a timestamp are summed, so every asset has strictly increasing times.
+    '''
+    times, values = [], []
+    for log_ret in x:
+        t = log_ret.index.values.astype('datetime64[ns]').view(np.int64)
+        v = np.asarray(log_ret.to_numpy(), dtype=float).reshape(len(t), -1)
+        order = np.argsort(t, kind='stable')
+        t, v = t[order], v[order]
+        t, start = np.unique(t, return_index=True)
+        if len(t) != len(order):
+            v = np.add.reduceat(v, start, axis=0)
+        times.append(t)
+        values.append(v)
+    return times, values
+
+
+def align(times):
+    '''
+    Merge the timestamps of all assets once
+    input
+    times (list[np.ndarray]): sorted int64 timestamps of each asset
+
+    output
+    grid: the sorted union of all timestamps (G,)
+    ptr: index of the last tick of each asset at or before each grid time, -1 before the first tick (G, N)
+    tick: True where the asset has a tick exactly at the grid time (G, N)
+    '''
+    grid = np.unique(np.concatenate(times)) if len(times) else np.zeros(0, dtype=np.int64)
+    ptr = np.empty((len(grid), len(times)), dtype=np.int64)
+    tick = np.zeros((len(grid), len(times)), dtype=bool)
+    for a, t in enumerate(times):
+        ptr[:, a] = np.searchsorted(t, grid, side='right') - 1
+        tick[np.searchsorted(grid, t), a] = True
+    return grid, ptr, tick
+
+
+def hy_from_aligned(ptr, tick, values):
+    '''
+    Hayashi-Yoshida covariances of already aligned assets.
+
+    The pairwise estimator sums, over the union of the two assets' ticks, the product of their last returns (the
+    forward filled outer join of covariances_Hayashi_Yoshida). Splitting the union into the ticks of i, the ticks of j,
+    minus the common ticks counted twice, the sum of the pair (i, j) is H_ij + H_ji with
+        H_ij = sum over the ticks of i of r_i * V_j * (1 - 1/2 if j also ticks)
+    and V_j the last return of j. Row i of H only needs the last returns of every asset at the ticks of i, so all
+    pairs cost sum_i T_i * N products instead of N^2 joins.
+
+    input
+    ptr, tick: output of align (G, N)
+    values (list[np.ndarray]): returns of each asset, (T_a, B) where B is the number of series per asset
+
+    output
+    Covariance stack (B, N, N)
+    '''
+    N = ptr.shape[1]
+    B = values[0].shape[1] if len(values) else 1
+    H = np.zeros((B, N, N))
+    for i, (v, rows, last) in enumerate(_last_returns(ptr, tick, values)):
+        H[:, i, :] = np.einsum('kb,kjb->bj', v, last)
+    return H + H.transpose(0, 2, 1)
+
+
+def _last_returns(ptr, tick, values):
+    '''
+    For each asset i, its returns, the grid rows of its ticks and the last returns of every asset at these ticks,
+    halved where the other asset ticks too: (T_i, B), (T_i,), (T_i, N, B)
+    '''
+    B = values[0].shape[1] if len(values) else 1
+    offsets = np.cumsum([0] + [len(v) for v in values])
+    # the last row is a zero return standing for "no tick yet"
+    flat = np.concatenate(list(values) + [np.zeros((1, B))])
+    gather = np.where(ptr >= 0, ptr + offsets[:-1], offsets[-1])
+    for i, v in enumerate(values):
+        rows = np.flatnonzero(tick[:, i])
+        last = np.take(flat, gather[rows], axis=0)
+        common = np.nonzero(tick[rows])
+        last[common] *= 0.5
+        yield v, rows, last
+
+
+def hy_terms(ptr, tick, values):
+    '''
+    Terms of the Hayashi-Yoshida sums of hy_from_aligned, before the sum over the ticks.
+    The estimator is bilinear, so a covariance weighting the grid times differently (a bootstrap resampling the grid)
+    is a weighted sum of the same terms: they are computed once, and each weighting is a matrix product.
+    input
+    ptr, tick: output of align (G, N)
+    values (list[np.ndarray]): returns of each asset (T_a, 1)
+
+    output
+    list of (rows, terms) for each asset i: the grid rows of the ticks of i (T_i,), and r_i times the weighted last
+    returns of every asset at these ticks (T_i, N), so that hy_from_aligned is H + H.T with H[i] = terms.sum(axis=0)
+    '''
+    return [(rows, v[:, :1] * last[:, :, 0]) for v, rows, last in _last_returns(ptr, tick, values)]
+
+
+def hy_weighted(terms, weights):
+    '''
+    Hayashi-Yoshida covariances with each grid time counted with a weight
+    input
+    terms: output of hy_terms
+    weights: weight of every grid time for each of B estimates (B, G)
+
+    output
+    Covariance stack (B, N, N), equal to hy_from_aligned for weights of one
+    '''
+    N = len(terms)
+    H = np.zeros((weights.shape[0], N, N))
+    for i, (rows, t) in enumerate(terms):
+        H[:, i, :] = weights[:, rows] @ t
+    return H + H.transpose(0, 2, 1)
+
+
+def hy_noise_terms(ptr, tick, values):
+    '''
+    Terms of the Hayashi-Yoshida sums of returns perturbed by small noises x = r + e, which do not depend on e.
+    Row i of H (see hy_from_aligned) is sum over the ticks k of i of x_i[k] w_kj x_j[last_j(k)], so with x = r + e
+        H_ij = H0_ij + sum_k e_i[k] L_i[k, j] + sum_m e_j[m] S_j[i, m] + sum_k e_i[k] w_kj e_j[last_j(k)]
+    with L_i[k, j] = w_kj r_j[last_j(k)] the weighted last returns at the ticks of i, and S_j[i, m] the sum of
+    r_i[k] w_kj over the ticks k of i whose last tick of j is m. H0, L and S are computed once, and every noise is
+    then two matrix products per asset in hy_noisy.
+    input
+    ptr, tick: output of align (G, N)
+    values (list[np.ndarray]): returns of each asset without noise (T_a, 1)
+
+    output
+    H0 (N, N), L (list of (T_i, N)), S (list of (N, T_j))
+    '''
+    N = ptr.shape[1]
+    offsets = np.cumsum([0] + [len(v) for v in values])
+    H0 = np.zeros((N, N))
+    L = []
+    S = np.zeros((N, offsets[-1]))
+    for i, (v, rows, last) in enumerate(_last_returns(ptr, tick, values)):
+        last = last[:, :, 0]
+        H0[i] = v[:, 0] @ last
+        L.append(last)
+        p = ptr[rows]
+        weights = np.where(tick[rows], 0.5, 1.0) * v
+        valid = p >= 0
+        S[i] = np.bincount((p + offsets[:-1])[valid], weights[valid], minlength=offsets[-1])
+    return H0, L, [S[:, lo:hi] for lo, hi in zip(offsets[:-1], offsets[1:])]
+
+
+def hy_noisy(terms, noises):
+    '''
+    Hayashi-Yoshida covariances of the returns of hy_noise_terms plus B noises, as hy_from_aligned on r + e.
+    The product of two noises is only kept on the diagonal (the variances): off the diagonal it is a sum of products
+    of independent noises, of order eps^2 sqrt(T), far below the rounding errors of the covariance for the noises of
+    BAHC (eps = 1e-10), which is what makes the noises two matrix products per asset instead of a gather per copy.
+    input
+    terms: output of hy_noise_terms
+    noises (list[np.ndarray]): noise of each asset (T_a, B)
+
+    output
+    Covariance stack (B, N, N)
+    '''
+    H0, L, S = terms
+    N, B = len(L), noises[0].shape[1] if len(noises) else 1
+    H = np.broadcast_to(H0, (B, N, N)).copy()
+    for i, e in enumerate(noises):
+        H[:, i, :] += e.T @ L[i]
+        H[:, :, i] += (S[i] @ e).T
+        H[:, i, i] += 0.5 * np.einsum('kb,kb->b', e, e)
+    return H + H.transpose(0, 2, 1)
+
+
+def _window(times, values, start, end):
+    bounds = [(np.searchsorted(t, start, side='left'), np.searchsorted(t, end, side='right')) for t in times]
+    return [t[lo:hi] for t, (lo, hi) in zip(times, bounds)], [v[lo:hi] for v, (lo, hi) in zip(values, bounds)]
+
+
+def _timestamp(x):
+    return pd.Timestamp(x).to_datetime64().astype('datetime64[ns]').view(np.int64)
+
+
+def covariance_matrix_Hayashi_Yoshida(x):
+    '''
+    Full Hayashi-Yoshida covariance matrix of all assets, merging the timestamps once instead of joining every pair.
+    input
+    x (list[pd.DataFrame]): list of log return dataframe indexed by time. Every column is estimated separately.
+
+    output
+    Covariance matrix NxN. If the dataframes have B > 1 columns, the output is a stack BxNxN (one matrix per column)
+    '''
+    times, values = _to_arrays(x)
+    _, ptr, tick = align(times)
+    cov = hy_from_aligned(ptr, tick, values)
+    if cov.shape[0] == 1:
+        return cov[0]
+    return cov
+
+
+def rolling_covariances_Hayashi_Yoshida(x, windows):
+    '''
+    Hayashi-Yoshida covariance matrices of many time windows in one sweep.
+    The series are converted to arrays once, and each window is a binary search away instead of a pandas slice and
+    N(N+1)/2 joins.
+    input
+    x (list[pd.DataFrame]): list of single column log return dataframe indexed by time
+    windows: list of (start, end) pairs, both included as with .loc[start:end]
+
+    output
+    Covariance matrices stacked as (len(windows), N, N)
+    '''
+    times, values = _to_arrays(x)
+    covs = np.zeros((len(windows), len(x), len(x)))
+    for w, (start, end) in enumerate(windows):
+        t, v = _window(times, values, _timestamp(start), _timestamp(end))
+        _, ptr, tick = align(t)
+        covs[w] = hy_from_aligned(ptr, tick, v)[0]
+    return covs
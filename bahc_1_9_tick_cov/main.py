@@ -1,11 +1,31 @@
+import time
+import warnings
+from functools import lru_cache
+
 import numpy as np
 import pandas as pd
 import fastcluster
-from statsmodels.stats.correlation_tools import cov_nearest
+
+import instrumentation
+
+from bahc_1_9_tick_cov.hayashi_yoshida import _to_arrays, align, hy_noise_terms, hy_noisy, hy_terms, hy_weighted
+from bahc_1_9_tick_cov.nearest import NearestPSD, nearest_psd
+
+# Upper bound on the floats of the noises or weights of a bootstrap batch (Nboot x ticks), i.e. 128MB
+MAX_BATCH_FLOATS = 2 ** 24
+# Filtered matrices whose smallest eigenvalue is above this are already semi-positive and may skip the repair
+PSD_THRESHOLD = 1e-15
+# Draws of a grid bootstrap before giving up on weighting a tick of every asset
+MAX_GRID_DRAWS = 1000
+
+@lru_cache(maxsize=None)
+def _upper_triangle(N):
+    return np.triu_indices(N, 1)
+
 
 def dist(R):
     N = R.shape[0]
-    d = R[idx]
+    d = R[_upper_triangle(N)]
     out = fastcluster.average(d)
     rho = 1 - out[:, 2]
     #
@@ -32,8 +52,73 @@ def AvLinkC(Dend, rho, R):
     return Rs
 
 
-def noise(T, epsilon=1e-10):
-    return np.random.normal(0, epsilon, size=(T))
+def ultrametric(R):
+    '''
+    Average linkage ultrametric matrix of the distance matrix R, as AvLinkC(*dist(R), R) without building the
+    genealogy lists. Every cluster of the dendrogram is a contiguous range of leaves in the dendrogram order, so each
+    merge fills two rectangular blocks of the reordered matrix, and the order is undone once at the end: O(N^2) writes
+    in N slice assignments, and no state shared between calls.
+    input
+    R: distance matrix 1 - C (N, N)
+
+    output
+    Ultrametric matrix with ones on the diagonal (N, N)
+    '''
+    N = R.shape[0]
+    out = fastcluster.average(R[_upper_triangle(N)])
+    children = out[:, :2].astype(np.intp).tolist()
+    rho = (1 - out[:, 2]).tolist()
+    size = np.ones(2 * N - 1, dtype=np.intp)
+    size[N:] = out[:, 3]
+    size = size.tolist()
+    # first position of every node in the dendrogram order, from the root down
+    start = [0] * (2 * N - 1)
+    for i in range(N - 2, -1, -1):
+        a, b = children[i]
+        start[a] = start[N + i]
+        start[b] = start[N + i] + size[a]
+    Rs = np.empty((N, N))
+    for (a, b), r in zip(children, rho):
+        block_a = slice(start[a], start[a] + size[a])
+        block_b = slice(start[b], start[b] + size[b])
+        Rs[block_a, block_b] = r
+        Rs[block_b, block_a] = r
+    np.fill_diagonal(Rs, 1)
+    order = np.array(start[:N])
+    return Rs[np.ix_(order, order)]
+
+
+def noise(T, epsilon=1e-10, rng=np.random):
+    return rng.normal(0, epsilon, size=(T))
+
+
+def grid_weights(G, B, rows, rng=np.random):
+    '''
+    Weights of the grid times for B bootstraps: the number of times each of the G times is drawn in G draws with
+    replacement. An asset none of whose ticks is drawn would have a zero variance and undefined correlations, so these
+    bootstraps are drawn again; an asset with one tick is missed by about 37% of the draws.
+    input
+    G: number of grid times
+    B: number of bootstraps
+    rows (list[np.ndarray]): the grid rows of the ticks of each asset, assets without ticks are ignored
+    rng: random generator
+
+    output
+    weights (B, G)
+    '''
+    weights = np.zeros((B, G))
+    missing = np.arange(B)
+    for _ in range(MAX_GRID_DRAWS):
+        weights[missing] = [np.bincount(rng.integers(0, G, G), minlength=G) for _ in missing]
+        drawn = np.ones(len(missing), dtype=bool)
+        for r in rows:
+            if len(r):
+                drawn &= (weights[np.ix_(missing, r)] > 0).any(axis=1)
+        missing = missing[~drawn]
+        if len(missing) == 0:
+            return weights
+    raise ValueError("No draw of the grid in {0} weighted a tick of every asset, too few ticks for the grid "
+                     "bootstrap".format(MAX_GRID_DRAWS))
 
 
 def no_neg(x):
@@ -43,37 +128,102 @@ def no_neg(x):
     return np.dot(v * l, v.T)
 
 
-def near(x, niter=100, eigtol=1e-6, conv=1e-8):
-    D = np.zeros(x.shape)
-    diag = x.diagonal()
+def no_neg_batch(x):
+    '''
+    no_neg over the first axis of a stack of matrices (B, N, N)
+    '''
+    l, v = np.linalg.eigh(x)
+    return (v * np.maximum(l, 0)[:, None, :]) @ v.transpose(0, 2, 1)
 
-    for _ in range(niter):
 
-        y = x
-        R = x - D
-        x = no_neg(R)
-        D = x - R
-        np.fill_diagonal(x, diag)
+def cov_nearest_batch(x, threshold=1e-15):
+    '''
+    statsmodels cov_nearest (method 'clipped') over the first axis of a stack of matrices (B, N, N)
+    '''
+    std = np.sqrt(np.diagonal(x, axis1=1, axis2=2))
+    si_sj = std[:, :, None] * std[:, None, :]
+    corr = x / si_sj
+    l, v = np.linalg.eigh(corr)
+    clipped = (l < threshold).any(axis=1)
+    if clipped.any():
+        corr_clipped = (v[clipped] * np.maximum(l[clipped], threshold)[:, None, :]) @ v[clipped].transpose(0, 2, 1)
+        s = np.sqrt(np.diagonal(corr_clipped, axis1=1, axis2=2))
+        corr[clipped] = corr_clipped / (s[:, :, None] * s[:, None, :])
+    return corr * si_sj
 
-        if np.linalg.norm(x - y, ord=np.inf) / np.linalg.norm(y, ord=np.inf) < conv:
-            break
-    else:
-        print("it didn't converge")
-    return x
+
+def near(x, niter=100, eigtol=1e-6, conv=1e-8):
+    '''
+    Nearest semi-positive matrix with the diagonal of x, see nearest_psd. conv is the tolerance on the relative error
+    of the diagonal, and a RuntimeWarning is raised if it is not reached in niter iterations.
+    '''
+    x, _, _, residual = nearest_psd(x[None], niter=niter, conv=conv)
+    if residual[0] >= conv:
+        warnings.warn("near did not converge in {0} iterations, residual {1:.3g}".format(niter, residual[0]),
+                      RuntimeWarning, stacklevel=2)
+    return x[0]
 
 
 def HigherOrder(C, K):
     Cf = np.identity(C.shape[0])
     for i in range(max(K)):
-        res = C - Cf
-        dend, rho = dist(1 - res)
-        res = AvLinkC(dend, rho, res)
+        res = ultrametric(1 - (C - Cf))
         np.fill_diagonal(res, 0)
         Cf += res
         if i + 1 in K:
             yield Cf.copy()
 
 
+def HigherOrderBatch(C, K, out=None):
+    '''
+    HigherOrder over the first axis of a stack of correlation matrices (B, N, N).
+    Each recursion level dispatches the linkage of every matrix of the batch before moving to the next level, and
+    order k + 1 is the linkage of the residual of order k added to it, so a sweep over K = 1..10 costs 10 linkages per
+    matrix. The levels are computed in two (B, N, N) buffers and written to out.
+    input
+    out: optional preallocated output, reused across batches (at least B, len(set(K)), N, N)
+
+    output
+    Filtered matrices (B, len(K), N, N), orders in increasing order as yielded by HigherOrder
+    '''
+    B, N = C.shape[0], C.shape[1]
+    orders = sorted(set(K))
+    if out is None:
+        out = np.empty((B, len(orders), N, N))
+    out = out[:B]
+    Cf = np.broadcast_to(np.identity(N), C.shape).copy()
+    res = np.empty_like(Cf)
+    diag = np.arange(N)
+    for i in range(orders[-1]):
+        # distance of the residual correlation, 1 - (C - Cf)
+        np.subtract(Cf, C, out=res)
+        res += 1
+        for b in range(B):
+            res[b] = ultrametric(res[b])
+        res[:, diag, diag] = 0
+        Cf += res
+        if i + 1 in orders:
+            out[:, orders.index(i + 1)] = Cf
+    return out
+
+
+def _repair_and_accumulate(C, Cf, repair, skip_psd=False):
+    '''
+    Add the repaired filtered matrices of a batch (B, len(K), N, N) to the accumulator C (len(K), N, N), in place.
+    With skip_psd, only the matrices with an eigenvalue below PSD_THRESHOLD are repaired, the eigenvalues alone being
+    cheaper than the repair.
+    '''
+    flat = Cf.reshape(-1, C.shape[1], C.shape[2])
+    if skip_psd:
+        negative = np.flatnonzero(np.linalg.eigvalsh(flat)[:, 0] < PSD_THRESHOLD)
+        instrumentation.count("bahc.psd.repaired", len(negative))
+        if len(negative):
+            flat[negative] = repair(flat[negative])
+    else:
+        flat[:] = repair(flat)
+    C += Cf.sum(axis=0)
+
+
 def covariances_Hayashi_Yoshida(asset1: pd.DataFrame, asset2: pd.DataFrame, N_boot):
     asset1 = asset1.add_prefix("l_")
     asset2 = asset2.add_prefix("r_")
@@ -87,59 +237,134 @@ def covariances_Hayashi_Yoshida(asset1: pd.DataFrame, asset2: pd.DataFrame, N_bo
     return covs
 
 
-def filterCovariance(x, K=1, Nboot=100, method='near', is_correlation=False):
+def filterCovariance(x, K=1, Nboot=100, method='near', is_correlation=False, batch_size=None, seed=None,
+                     bootstrap='noise', nearest=None, skip_psd=False):
     '''
     Fiter covariance with k-BAHC
     input
     x (list[pd.DataFrame]): list of log return dataframe
     K = recursion order. K can be a list if you want to compute different order simultaneusly, K=1 is the standard BAHC.
+        The orders are computed incrementally, so a list costs as much as its highest order
     Nboot: Number of bootstraps
     method: regularization of negative eigenvalues. 'no-neg' set them to zeros, 'near' find the neareset semi-positive matrix
+        by clipping the eigenvalues of the correlation, 'nearest' the nearest correlation matrix with nearest_psd, each
+        bootstrap batch starting from the solution of the previous one
     is_correlation: Set to True if you want to filter the correlation
+    batch_size: Number of bootstraps computed together as one (batch_size, N, N) array operation. By default it is
+        chosen so that the last returns gathered for one asset stay under MAX_BATCH_FLOATS.
+    seed: seed of the noise generator
+    bootstrap: how the bootstrap copies differ. 'noise' adds to every return a tiny noise shuffled for each copy,
+        which copies the series and recomputes the estimator for every bootstrap. 'grid' resamples with replacement
+        the times of the merged tick grid: the estimator is bilinear, so its terms are computed once and every copy
+        is a weighted sum of them, using about T x N floats instead of Nboot x T x N.
+    nearest: NearestPSD engine of the 'nearest' method, to keep its diagnostics or to share its warm start across calls
+        (the previous day). By default a new engine per call.
+    skip_psd: only repair the filtered matrices with a negative eigenvalue, the others are averaged as they are. The
+        results differ by rounding errors, and the repair of the semi-positive matrices is saved
 
     output
-    Fitered covariance matrix NxN. If K is a list, then is then the output is a list of matrices NxN
+    Fitered covariance matrix NxN. If K is a list, then is then the output is an array of matrices (len(K), NxN), in
+    increasing order of K
+    '''
+    return _filter_covariance_arrays(*_to_arrays(x), K=K, Nboot=Nboot, method=method,
+                                     is_correlation=is_correlation, batch_size=batch_size, seed=seed,
+                                     bootstrap=bootstrap, nearest=nearest, skip_psd=skip_psd)
+
+
+def filterCovarianceSweep(x, max_order=10, **kwargs):
+    '''
+    Fiter covariance with k-BAHC for every order K = 1..max_order at once, for the selection of K. The bootstraps, their
+    linkages and the repairs are shared by all orders, see filterCovariance for the other arguments.
+
+    output
+    Fitered covariance matrices (max_order, N, N), the matrix of order K at index K - 1
+    '''
+    return filterCovariance(x, K=list(range(1, max_order + 1)), **kwargs)
+
+
+def _filter_covariance_arrays(times, values, K=1, Nboot=100, method='near', is_correlation=False, batch_size=None,
+                              seed=None, bootstrap='noise', nearest=None, skip_psd=False, aligned=None):
+    '''
+    filterCovariance on the int64 timestamps and (T, 1) log returns of each asset
+    aligned: the (ptr, tick) of align on the times, if already known (preprocessing.TickIndex)
     '''
-    x = x.copy()
     is_int = type(K) == int
     if is_int == True:
         K = [K]
+    K = sorted(set(K))
 
-    f = {'no-neg': no_neg, 'near': cov_nearest}
+    f = {'no-neg': no_neg_batch, 'near': cov_nearest_batch, 'nearest': nearest if nearest is not None else NearestPSD()}
+    if bootstrap not in ('noise', 'grid'):
+        raise ValueError("bootstrap must be 'noise' or 'grid', not {0!r}".format(bootstrap))
 
-    N = len(x)
-    global idx
-    idx = np.triu_indices(N, 1)
+    N = len(times)
     C = np.zeros((len(K), N, N))
+    rng = np.random.default_rng(seed)
 
-    # create noise for each log return
-    for idx_asset in range(len(x)):
-        log_ret = x[idx_asset]
-        T = log_ret.shape[0]
-        prices = log_ret.to_numpy().reshape(-1)
-        prices_with_noises =  noise(T).reshape(1, -1).repeat(Nboot, axis =0)
-        prices_with_noises[0] = np.zeros((T))
-        rng = np.random.default_rng()
-        for i in range(Nboot):
-            rng.shuffle(prices_with_noises[i])
-            prices_with_noises[i] += prices
-        x[idx_asset] = pd.DataFrame(index = log_ret.index, data= prices_with_noises.T)
-    # calculate the covariance boost
-
-    cov_boosts = np.zeros((Nboot, len(x), len(x)))
-    for i, asset1 in enumerate(x):
-        for j, asset2 in enumerate(x[i:], start=i):
-            cov_boosts[:, i, j] = covariances_Hayashi_Yoshida(asset1, asset2, Nboot)
-            cov_boosts[:, j, i] = cov_boosts[:, i, j]
-    for cov in cov_boosts:
-        standard_deviations = np.sqrt(np.diag(cov))
-        si_sj = np.outer(standard_deviations, standard_deviations)
-        Cb = cov / si_sj
-        C += np.array(list(map(f[method], (np.array(list(HigherOrder(Cb, K)))))))
+    # timestamps are merged once, every bootstrap shares the same alignment
+    if aligned is not None:
+        ptr, tick = aligned
+    else:
+        with instrumentation.timer("bahc.align"):
+            _, ptr, tick = align(times)
+    G = len(ptr)
+    if bootstrap == 'noise':
+        noises = [noise(len(t), rng=rng) for t in times]
+        # the estimator is bilinear: the terms without noise are computed once, each noise is then two matrix products
+        with instrumentation.timer("bahc.hy"):
+            terms = hy_noise_terms(ptr, tick, values)
+        if batch_size is None:
+            batch_size = max(1, MAX_BATCH_FLOATS // max(1, sum(len(t) for t in times)))
+    else:
+        # the terms of the estimator are computed once, the bootstraps only weight them
+        with instrumentation.timer("bahc.hy"):
+            terms = hy_terms(ptr, tick, values)
+        if batch_size is None:
+            batch_size = max(1, MAX_BATCH_FLOATS // max(1, G))
+
+    repairs = f[method].total_iterations if method == 'nearest' else 0
+    # filtered matrices of a batch, reused by every batch
+    Cf = np.empty((min(batch_size, Nboot), len(K), N, N))
+    for start in range(0, Nboot, batch_size):
+        B = min(batch_size, Nboot - start)
+        batch_start = time.perf_counter()
+        if bootstrap == 'noise':
+            # create noise for each log return: the same noises shuffled for each bootstrap, first boost is w.o noises
+            with instrumentation.timer("bahc.noise"):
+                e_boots = []
+                for eps in noises:
+                    boots = rng.permuted(np.tile(eps, (B, 1)), axis=1)
+                    if start == 0:
+                        boots[0] = 0
+                    e_boots.append(boots.T)
+            # calculate the covariance boost
+            with instrumentation.timer("bahc.hy"):
+                cov_boosts = hy_noisy(terms, e_boots)
+        else:
+            # number of times each grid time is drawn in G draws with replacement, first boost is the whole grid
+            with instrumentation.timer("bahc.noise"):
+                weights = grid_weights(G, B, [rows for rows, _ in terms], rng=rng)
+                if start == 0:
+                    weights[0] = 1
+            with instrumentation.timer("bahc.hy"):
+                cov_boosts = hy_weighted(terms, weights)
+        if start == 0:
+            cov = cov_boosts[0]
+        standard_deviations = np.sqrt(np.diagonal(cov_boosts, axis1=1, axis2=2))
+        Cb = cov_boosts / (standard_deviations[:, :, None] * standard_deviations[:, None, :])
+        with instrumentation.timer("bahc.linkage"):
+            Cf_batch = HigherOrderBatch(Cb, K, out=Cf)
+        with instrumentation.timer("bahc.psd"):
+            _repair_and_accumulate(C, Cf_batch, f[method], skip_psd)
+        instrumentation.count("bahc.boots", B)
+        instrumentation.observe("bahc.boot", (time.perf_counter() - batch_start) / B)
+
+    if method == 'nearest':
+        instrumentation.count("bahc.psd.iterations", f[method].total_iterations - repairs)
 
     if is_correlation == False:
         # std without noises, first boost is w.o noises
-        standard_deviations = np.sqrt(np.diag(cov_boosts[0]))
+        standard_deviations = np.sqrt(np.diag(cov))
         si_sj = np.outer(standard_deviations, standard_deviations)
         C = (C / Nboot) * si_sj
     else:
@@ -0,0 +1,123 @@
+import warnings
+
+import numpy as np
+
+
+def _psd(x):
+    l, v = np.linalg.eigh(x)
+    return (v * np.maximum(l, 0)[..., None, :]) @ np.swapaxes(v, -1, -2)
+
+
+def nearest_psd(x, y=None, niter=100, conv=1e-8, memory=5):
+    '''
+    Nearest positive semi-definite matrices with the same diagonal (Higham's alternating projections, as near), over
+    the first axis of a stack of matrices.
+    The projections are run on the dual variable y, the vector added to the diagonal before the projection on the
+    positive semi-definite cone: X = P(x + diag(y)) is the solution once diag(X) = diag(x), and one plain step
+    y += diag(x) - diag(X) is one iteration of alternating projections with Dykstra's correction. The solution does
+    not depend on the starting y, so y can be warm started from a close problem (the previous bootstrap or day), and
+    the steps are accelerated with Anderson mixing of the last `memory` steps. Converged matrices leave the batch.
+    input
+    x: symmetric matrices (B, N, N)
+    y: starting dual variables, broadcastable to (B, N). By default zeros, the start of near
+    niter: maximum number of iterations
+    conv: tolerance on the largest diagonal error, relative to the largest diagonal element
+    memory: number of steps mixed by the Anderson acceleration, 0 for plain alternating projections
+
+    output
+    X: nearest matrices, with the diagonal of x (B, N, N)
+    y: dual variables, the warm start of a close problem (B, N)
+    iterations: number of eigen decompositions of each matrix (B,)
+    residual: relative diagonal error of each matrix at its last iteration (B,)
+    '''
+    x = np.asarray(x, dtype=float)
+    B, N = x.shape[0], x.shape[1]
+    b = np.diagonal(x, axis1=1, axis2=2).copy()
+    scale = np.maximum(np.abs(b).max(axis=1, initial=0), np.finfo(float).tiny)
+    y = np.zeros((B, N)) if y is None else np.broadcast_to(y, (B, N)).astype(float)
+    out = np.empty_like(x)
+    iterations = np.zeros(B, dtype=np.int64)
+    residual = np.full(B, np.inf)
+    # Anderson history of the differences of consecutive dual variables and diagonal errors
+    dy, dr = np.zeros((B, memory, N)), np.zeros((B, memory, N))
+    last_y, last_r = np.zeros((B, N)), np.zeros((B, N))
+    diag = np.arange(N)
+    active = np.arange(B)
+
+    for k in range(niter):
+        shifted = x[active]
+        shifted[:, diag, diag] += y[active]
+        X = _psd(shifted)
+        out[active] = X
+        iterations[active] = k + 1
+        r = b[active] - np.diagonal(X, axis1=1, axis2=2)
+        residual[active] = np.abs(r).max(axis=1) / scale[active]
+
+        step = r
+        if memory > 0 and k > 0:
+            slot = (k - 1) % memory
+            dy[active, slot] = y[active] - last_y[active]
+            dr[active, slot] = r - last_r[active]
+            h = min(k, memory)
+            Y, R = dy[active, :h], dr[active, :h]
+            # least squares mixing of the last steps, regularized as the differences shrink
+            G = R @ R.transpose(0, 2, 1)
+            G += (1e-10 * np.trace(G, axis1=1, axis2=2) + np.finfo(float).tiny)[:, None, None] * np.identity(h)
+            gamma = np.linalg.solve(G, (R @ r[:, :, None]))[:, :, 0]
+            mixed = r - ((Y + R) * gamma[:, :, None]).sum(axis=1)
+            step = np.where(np.isfinite(mixed).all(axis=1, keepdims=True), mixed, r)
+        last_y[active], last_r[active] = y[active], r
+        y[active] += step
+
+        done = residual[active] < conv
+        active = active[~done]
+        if len(active) == 0:
+            break
+
+    out[:, diag, diag] = b
+    return out, y, iterations, residual
+
+
+class NearestPSD(object):
+    '''
+    Stateful nearest_psd for a sequence of close problems: each call starts from the dual variables of the previous
+    call, elementwise if the stacks have the same shape, else from their average. Share one engine across the
+    bootstrap batches of a day, or across days, to cut the number of iterations.
+    The diagnostics of the last call are kept in iterations, residual and converged, and their totals in calls,
+    total_iterations and unconverged. Matrices which did not converge are reported with a RuntimeWarning.
+    '''
+
+    def __init__(self, niter=100, conv=1e-8, memory=5, warm_start=True):
+        self.niter = niter
+        self.conv = conv
+        self.memory = memory
+        self.warm_start = warm_start
+        self.y = None
+        self.iterations = self.residual = self.converged = None
+        self.calls = self.total_iterations = self.unconverged = 0
+
+    def __call__(self, x):
+        '''
+        input
+        x: symmetric matrices (B, N, N)
+
+        output
+        nearest positive semi-definite matrices with the diagonal of x (B, N, N)
+        '''
+        y = None
+        if self.warm_start and self.y is not None and self.y.shape[-1] == x.shape[-1]:
+            y = self.y if self.y.shape == x.shape[:-1] else self.y.mean(axis=0)
+        X, self.y, self.iterations, self.residual = nearest_psd(x, y, self.niter, self.conv, self.memory)
+        self.converged = self.residual < self.conv
+        self.calls += 1
+        self.total_iterations += int(self.iterations.sum())
+        failed = int((~self.converged).sum())
+        self.unconverged += failed
+        if failed:
+            warnings.warn("{0} of {1} matrices did not converge in {2} iterations, largest residual {3:.3g}".format(
+                failed, len(X), self.niter, self.residual.max()), RuntimeWarning, stacklevel=2)
+        return X
+
+    def reset(self):
+        '''Forget the warm start and the diagnostics.'''
+        self.__init__(self.niter, self.conv, self.memory, self.warm_start)
@@ -0,0 +1,248 @@
+import threading
+import time
+
+import numpy as np
+import polars as pl
+
+import instrumentation
+
+from bahc_1_9_tick_cov.hayashi_yoshida import align
+from bahc_1_9_tick_cov.main import _filter_covariance_arrays
+
+TIME = "time (UTC)"
+NEVER = int(np.iinfo(np.int64).min)
+
+
+class OnlineHayashiYoshida(object):
+    '''
+    Hayashi-Yoshida covariance matrix updated as the ticks of a session arrive.
+
+    Ticks are given per symbol, in time order, as the frames of processor.decompress ("time (UTC)", "ask", "bid", ...).
+    Their mid price log returns are computed as tick_returns does (zero returns dropped, returns sharing a timestamp
+    summed) and kept pending until every symbol has been received past them: the estimator needs the last return of
+    every asset at each tick, so the events are processed in time order up to the earliest "latest tick" of the
+    symbols. Each processed tick of asset i adds r_i times the last returns of all assets to row i of the running sums
+    H (the decomposition of hy_from_aligned), O(N) work per tick, and the covariance is H + H.T at any time.
+
+    A symbol which does not trade holds the others back: call advance(time) when every tick up to a time is known
+    to be delivered (from the clock of the feed), or flush() to process everything received.
+    '''
+
+    def __init__(self, symbols, keep_ticks=True):
+        '''
+        input
+        symbols: names of the assets, in the order of the rows of the matrix
+        keep_ticks: keep the processed returns, which filter_covariance bootstraps. Without them only the running sums
+            are stored, N x N floats.
+        '''
+        self.symbols = list(symbols)
+        self._position = {symbol: a for a, symbol in enumerate(self.symbols)}
+        N = len(self.symbols)
+        self.keep_ticks = keep_ticks
+        self.lock = threading.Lock()
+        self.H = np.zeros((N, N))
+        # last return and last log mid price of every asset
+        self.last = np.zeros(N)
+        self.last_log_mid = np.full(N, np.nan)
+        self.latest = np.full(N, NEVER)
+        # every tick before received[a] (ns, excluded) has been given for asset a
+        self.received = np.full(N, NEVER)
+        # every event before processed has been added to H
+        self.processed = NEVER
+        self.pending_times = [np.zeros(0, dtype=np.int64) for _ in range(N)]
+        self.pending_values = [np.zeros(0) for _ in range(N)]
+        self.kept_times = [[] for _ in range(N)]
+        self.kept_values = [[] for _ in range(N)]
+        self.ticks = np.zeros(N, dtype=np.int64)
+
+    def update(self, symbol, ticks):
+        '''
+        Add a batch of ticks of one symbol, later than its previous batches, and process every event that became safe
+        input
+        symbol: name of the asset
+        ticks (pl.DataFrame): ticks with the columns "time (UTC)", "ask" and "bid", in time order
+        '''
+        a = self._position[symbol]
+        frame = ticks.select(pl.col(TIME).dt.epoch("ns").alias("ns"),
+                             ((pl.col("ask") + pl.col("bid")) / 2).log().alias("log_mid"))
+        t, log_mid = frame["ns"].to_numpy(), frame["log_mid"].to_numpy()
+        if len(t) == 0:
+            return
+        with self.lock:
+            if (len(t) > 1 and (np.diff(t) < 0).any()) or t[0] < self.latest[a] or t[0] < self.processed:
+                raise ValueError("Ticks of {0} are not in time order, or earlier than the processed ones".format(
+                    symbol))
+            r = np.diff(log_mid, prepend=self.last_log_mid[a])
+            keep = np.flatnonzero(np.isfinite(r) & (r != 0))
+            self.last_log_mid[a] = log_mid[-1]
+            self.latest[a] = t[-1]
+            self.pending_times[a] = np.concatenate([self.pending_times[a], t[keep]])
+            self.pending_values[a] = np.concatenate([self.pending_values[a], r[keep]])
+            # more ticks can still come at the time of the last one
+            self.received[a] = max(self.received[a], t[-1])
+            self._process(int(self.received.min()))
+
+    def advance(self, until):
+        '''
+        Declare that every tick at or before `until` has been given, for all symbols, and process them
+        input
+        until: time, anything np.datetime64 understands
+        '''
+        bound = int(np.datetime64(until, "ns").view(np.int64)) + 1
+        with self.lock:
+            np.maximum(self.received, bound, out=self.received)
+            self._process(int(self.received.min()))
+
+    def flush(self):
+        '''
+        Process every tick received so far. Ticks at or before the latest one received cannot be added anymore.
+        '''
+        with self.lock:
+            bound = max(int(self.latest.max()), self.processed - 1) + 1
+            np.maximum(self.received, bound, out=self.received)
+            self._process(bound)
+
+    def _process(self, bound):
+        if bound <= self.processed:
+            return
+        times, values = [], []
+        for a in range(len(self.symbols)):
+            split = np.searchsorted(self.pending_times[a], bound, side='left')
+            t, v = self.pending_times[a][:split], self.pending_values[a][:split]
+            self.pending_times[a], self.pending_values[a] = self.pending_times[a][split:], self.pending_values[a][split:]
+            t, start = np.unique(t, return_index=True)
+            if len(start) != split:
+                v = np.add.reduceat(v, start)
+            times.append(t)
+            values.append(v)
+        self.processed = bound
+        if sum(len(t) for t in times) == 0:
+            return
+
+        _, ptr, tick = align(times)
+        # the first row of every asset is its last return before this chunk
+        offsets = np.cumsum([0] + [len(v) + 1 for v in values])
+        flat = np.concatenate([np.append(last, v) for last, v in zip(self.last, values)])
+        gather = ptr + 1 + offsets[:-1]
+        for i, v in enumerate(values):
+            if len(v) == 0:
+                continue
+            rows = np.flatnonzero(tick[:, i])
+            last = flat[gather[rows]]
+            last[tick[rows]] *= 0.5
+            self.H[i] += v @ last
+            self.last[i] = v[-1]
+            self.ticks[i] += len(v)
+            if self.keep_ticks:
+                self.kept_times[i].append(times[i])
+                self.kept_values[i].append(v)
+        instrumentation.count("hy.online.ticks", len(ptr))
+
+    def covariance(self):
+        '''
+        output
+        Hayashi-Yoshida covariance matrix of the processed ticks (N, N), a copy
+        '''
+        with self.lock:
+            return self.H + self.H.T
+
+    def correlation(self):
+        cov = self.covariance()
+        standard_deviations = np.sqrt(np.diag(cov))
+        return cov / np.outer(standard_deviations, standard_deviations)
+
+    def returns(self):
+        '''
+        output
+        int64 nanosecond timestamps and log returns (T_a,) of every asset, processed so far
+        '''
+        if not self.keep_ticks:
+            raise ValueError("The ticks are not kept, create the estimator with keep_ticks=True")
+        with self.lock:
+            times = [np.concatenate(t) if t else np.zeros(0, dtype=np.int64) for t in self.kept_times]
+            values = [np.concatenate(v) if v else np.zeros(0) for v in self.kept_values]
+            # the concatenated chunks replace the list, so that the next call does not concatenate them again
+            self.kept_times = [[t] for t in times]
+            self.kept_values = [[v] for v in values]
+        return times, values
+
+    def filter_covariance(self, **kwargs):
+        '''
+        filterCovariance of the processed ticks, see filterCovariance for the arguments
+        '''
+        times, values = self.returns()
+        return _filter_covariance_arrays(times, [v[:, None] for v in values], **kwargs)
+
+
+class FilteredView(object):
+    '''
+    A filtered matrix recomputed at most every `interval` seconds, for instance
+        FilteredView(lambda: estimator.filter_covariance(K=1, Nboot=50), 60)
+        FilteredView(lambda: oracle.filter_covariance_AO(estimator.covariance()), 60)
+    value recomputes the matrix when it is older than the interval. start() (or a with block) refreshes it in a
+    background thread instead, so that value never waits for the filter. An exception of compute in the thread is kept
+    in error and raised by value until a later refresh succeeds, rather than serving the last matrix as if it were
+    fresh; the thread keeps refreshing.
+    '''
+
+    def __init__(self, compute, interval=60.0):
+        '''
+        input
+        compute: function without argument returning the filtered matrix
+        interval: seconds between two refreshes
+        '''
+        self.compute = compute
+        self.interval = interval
+        self.matrix = None
+        self.updated = None
+        self.refreshes = 0
+        self.error = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def refresh(self):
+        try:
+            matrix = self.compute()
+        except Exception as e:
+            self.error = e
+            raise
+        self.matrix, self.updated, self.error = matrix, time.monotonic(), None
+        self.refreshes += 1
+        return matrix
+
+    @property
+    def value(self):
+        if self.matrix is None or (self._thread is None and time.monotonic() - self.updated >= self.interval):
+            return self.refresh()
+        if self.error is not None:
+            raise self.error
+        return self.matrix
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception:
+                # kept in error for value, the next refresh tries again
+                pass
+            if self._stop.wait(self.interval):
+                return
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
@@ -0,0 +1,68 @@
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from bahc_1_9_tick_cov.hayashi_yoshida import _to_arrays, _timestamp, _window
+from bahc_1_9_tick_cov.main import _filter_covariance_arrays
+
+# state of a worker process: the shared memory blocks and the per-asset views on them
+_shared = {}
+
+
+def _attach(times_name, values_name, offsets):
+    times_shm, values_shm = SharedMemory(name=times_name), SharedMemory(name=values_name)
+    all_times = np.ndarray((offsets[-1],), dtype=np.int64, buffer=times_shm.buf)
+    all_values = np.ndarray((offsets[-1], 1), dtype=float, buffer=values_shm.buf)
+    _shared['shm'] = times_shm, values_shm
+    _shared['times'] = [all_times[lo:hi] for lo, hi in zip(offsets[:-1], offsets[1:])]
+    _shared['values'] = [all_values[lo:hi] for lo, hi in zip(offsets[:-1], offsets[1:])]
+
+
+def _filter_window(bounds, seed, kwargs):
+    times, values = _window(_shared['times'], _shared['values'], *bounds)
+    return _filter_covariance_arrays(times, values, seed=seed, **kwargs)
+
+
+def filterCovarianceWindows(x, windows, K=1, Nboot=100, method='near', is_correlation=False, max_workers=None,
+                            seed=None, bootstrap='noise', skip_psd=False):
+    '''
+    Fiter the covariance of many time windows with k-BAHC in parallel, one window per task of a process pool.
+    The tick arrays are copied once into shared memory, the workers only receive the bounds of their window.
+    Set OMP_NUM_THREADS=1 (before numpy is imported) so that the workers do not oversubscribe the cores.
+    input
+    x (list[pd.DataFrame]): list of single column log return dataframe over the whole period
+    windows: list of (start, end) pairs, both included as with .loc[start:end]
+    K, Nboot, method, is_correlation, bootstrap, skip_psd: see filterCovariance
+    max_workers: number of processes, by default the number of cores
+    seed: seed from which the independent seed of each window is derived
+
+    output
+    Fitered covariance matrices stacked as (len(windows), N, N). If K is a list, (len(windows), len(K), N, N)
+    '''
+    for i, log_ret in enumerate(x):
+        if log_ret.ndim != 2 or log_ret.shape[1] != 1:
+            raise ValueError("The log returns of asset {0} must be a single column dataframe, not of shape {1}".format(
+                i, log_ret.shape))
+    times, values = _to_arrays(x)
+    offsets = np.cumsum([0] + [len(t) for t in times])
+    bounds = [(_timestamp(start), _timestamp(end)) for start, end in windows]
+    seeds = np.random.SeedSequence(seed).spawn(len(windows))
+    kwargs = dict(K=K, Nboot=Nboot, method=method, is_correlation=is_correlation, bootstrap=bootstrap,
+                  skip_psd=skip_psd)
+
+    times_shm = SharedMemory(create=True, size=max(1, offsets[-1] * 8))
+    values_shm = SharedMemory(create=True, size=max(1, offsets[-1] * 8))
+    try:
+        if offsets[-1] > 0:
+            np.ndarray((offsets[-1],), dtype=np.int64, buffer=times_shm.buf)[:] = np.concatenate(times)
+            np.ndarray((offsets[-1], 1), dtype=float, buffer=values_shm.buf)[:] = np.concatenate(values)
+        with ProcessPoolExecutor(max_workers, initializer=_attach,
+                                 initargs=(times_shm.name, values_shm.name, offsets)) as executor:
+            C = np.array(list(executor.map(_filter_window, bounds, seeds, [kwargs] * len(windows))))
+    finally:
+        times_shm.close()
+        times_shm.unlink()
+        values_shm.close()
+        values_shm.unlink()
+    return C
@@ -0,0 +1,212 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, List
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# the downloader modules import each other by their file name
+sys.path.insert(0, os.path.join(ROOT, "data_downloader"))
+sys.path.insert(0, ROOT)
+
+from benchmarks.synthetic import SyntheticTicks  # noqa: E402
+
+
+def measure(function: Callable[[], object], repeat: int) -> Dict[str, float]:
+    """Run `function` `repeat` times and return the best, median and worst durations in seconds."""
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    return {"min": min(durations), "median": float(np.median(durations)), "max": max(durations)}
+
+
+def bench_decompress(data: SyntheticTicks, repeat: int) -> List[Dict]:
+    from processor import bytes_to_data, bytes_to_ticks, decompress
+    import lzma
+
+    payload = data.bi5_payload(0, 0)
+    raw = lzma.decompress(payload)
+    ticks = len(raw) // 20
+    day = data.day(0)
+    return [
+        {"name": "processor.decompress", "params": {"ticks": ticks},
+         "seconds": measure(lambda: decompress("SYN", day, payload), repeat)},
+        {"name": "processor.bytes_to_data", "params": {"ticks": ticks},
+         "seconds": measure(lambda: bytes_to_data(raw), repeat)},
+        {"name": "processor.bytes_to_ticks", "params": {"ticks": ticks},
+         "seconds": measure(lambda: bytes_to_ticks(day, raw), repeat)},
+    ]
+
+
+def bench_parquet_dumper(data: SyntheticTicks, repeat: int) -> List[Dict]:
+    from parquet_dumper import ParquetDumper
+
+    days = [data.day(day) for day in range(data.days)]
+    ticks = [data.ticks(0, day) for day in range(data.days)]
+    rows = sum(t.height for t in ticks)
+    results = []
+    for name, options in (("buffered", {}), ("streaming", {"max_buffer_bytes": 1024 ** 2}),
+                          ("partitioned", {"partitioned": True})):
+        def write():
+            with tempfile.TemporaryDirectory() as folder:
+                with ParquetDumper("SYN", days[0], days[-1], folder, days=days, **options) as dumper:
+                    for day, t in zip(days, ticks):
+                        dumper.append(day, t)
+        results.append({"name": "ParquetDumper", "params": {"mode": name, "rows": rows},
+                        "seconds": measure(write, repeat)})
+    return results
+
+
+def bench_hayashi_yoshida(data: SyntheticTicks, repeat: int) -> List[Dict]:
+    from bahc_1_9_tick_cov import covariance_matrix_Hayashi_Yoshida
+    from bahc_1_9_tick_cov.main import covariances_Hayashi_Yoshida
+
+    x = data.log_returns(0)
+    a, b = x[0].rename(columns={'logret': 0}), x[1].rename(columns={'logret': 0})
+    return [
+        {"name": "covariances_Hayashi_Yoshida", "params": {"pairs": 1, "ticks": data.ticks_per_day},
+         "seconds": measure(lambda: covariances_Hayashi_Yoshida(a, b, 1), repeat)},
+        {"name": "covariance_matrix_Hayashi_Yoshida", "params": {"assets": data.assets, "ticks": data.ticks_per_day},
+         "seconds": measure(lambda: covariance_matrix_Hayashi_Yoshida(x), repeat)},
+    ]
+
+
+def bench_filter_covariance(data: SyntheticTicks, repeat: int) -> List[Dict]:
+    from bahc_1_9_tick_cov import filterCovariance, filterCovarianceSweep
+
+    x = [frame['logret'].to_frame() for frame in data.log_returns(0)]
+    results = []
+    for Nboot in (10, 50):
+        for K in (1, [1, 2, 3]):
+            results.append({"name": "filterCovariance",
+                            "params": {"assets": data.assets, "ticks": data.ticks_per_day, "Nboot": Nboot, "K": K},
+                            "seconds": measure(lambda: filterCovariance(x, K=K, Nboot=Nboot, seed=0), repeat)})
+    for skip_psd in (False, True):
+        results.append({"name": "filterCovarianceSweep",
+                        "params": {"assets": data.assets, "ticks": data.ticks_per_day, "Nboot": 50, "max_order": 10,
+                                   "skip_psd": skip_psd},
+                        "seconds": measure(lambda: filterCovarianceSweep(x, 10, Nboot=50, seed=0, skip_psd=skip_psd),
+                                           repeat)})
+    return results
+
+
+def bench_average_oracle(data: SyntheticTicks, repeat: int) -> List[Dict]:
+    from average_oracle.AO import AO
+
+    covariances = data.covariances()
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "AO.csv")
+        np.savetxt(path, np.linspace(0.2, 3, data.assets)[None], delimiter=",")
+        oracle = AO(path)
+    window = min(10, data.days)
+    return [
+        {"name": "AO.filter_covariance_AO", "params": {"assets": data.assets},
+         "seconds": measure(lambda: oracle.filter_covariance_AO(covariances[0]), repeat)},
+        {"name": "AO.filter_rolling_covariance_AO", "params": {"assets": data.assets, "days": data.days,
+                                                                "window": window},
+         "seconds": measure(lambda: oracle.filter_rolling_covariance_AO(covariances, window), repeat)},
+    ]
+
+
+def bench_rie(data: SyntheticTicks, repeat: int) -> List[Dict]:
+    from RIE.rie_est import get_rie
+
+    covariances = data.covariances()
+    correlations = covariances / np.sqrt(np.einsum('dii,djj->dij', covariances, covariances))
+    return [
+        {"name": "get_rie", "params": {"assets": data.assets},
+         "seconds": measure(lambda: get_rie(correlations[0]), repeat)},
+        {"name": "get_rie", "params": {"assets": data.assets, "days": data.days},
+         "seconds": measure(lambda: get_rie(correlations), repeat)},
+    ]
+
+
+def bench_nearest(data: SyntheticTicks, repeat: int) -> List[Dict]:
+    from bahc_1_9_tick_cov.main import cov_nearest_batch, near
+    from bahc_1_9_tick_cov.nearest import nearest_psd
+
+    covariances = data.covariances(samples=data.assets // 2)
+    correlations = covariances / np.sqrt(np.einsum('dii,djj->dij', covariances, covariances))
+    # rank deficient correlations with a perturbation, so that the repair has work to do
+    noise = np.random.default_rng(data.seed).normal(0, 0.05, correlations.shape)
+    correlations += noise + noise.transpose(0, 2, 1)
+    correlations[:, np.arange(data.assets), np.arange(data.assets)] = 1
+    return [
+        {"name": "cov_nearest_batch", "params": {"assets": data.assets, "days": data.days},
+         "seconds": measure(lambda: cov_nearest_batch(correlations), repeat)},
+        {"name": "near", "params": {"assets": data.assets, "days": data.days},
+         "seconds": measure(lambda: [near(c) for c in correlations], repeat)},
+        {"name": "nearest_psd", "params": {"assets": data.assets, "days": data.days},
+         "seconds": measure(lambda: nearest_psd(correlations), repeat)},
+    ]
+
+
+BENCHMARKS = {
+    "decompress": bench_decompress,
+    "parquet_dumper": bench_parquet_dumper,
+    "hayashi_yoshida": bench_hayashi_yoshida,
+    "filter_covariance": bench_filter_covariance,
+    "average_oracle": bench_average_oracle,
+    "rie": bench_rie,
+    "nearest": bench_nearest,
+}
+
+
+def revision() -> str:
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='benchmarks', description='Time the hot paths on synthetic tick data')
+    parser.add_argument('-a', '--assets', type=int, default=33, help='number of assets (default 33)')
+    parser.add_argument('-t', '--ticks', type=int, default=2500, help='average ticks per asset and day (default 2500)')
+    parser.add_argument('-d', '--days', type=int, default=20, help='number of days (default 20)')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='runs of every benchmark (default 3)')
+    parser.add_argument('-s', '--seed', type=int, default=0, help='seed of the synthetic data (default 0)')
+    parser.add_argument('-o', '--output', type=str, help='JSON file of the results (default stdout)')
+    parser.add_argument('benchmarks', nargs='*', help='benchmarks to run (default all): ' + ' '.join(BENCHMARKS))
+    args = parser.parse_args()
+    unknown = [name for name in args.benchmarks if name not in BENCHMARKS]
+    if unknown:
+        parser.error('unknown benchmarks {0}, choose from {1}'.format(' '.join(unknown), ' '.join(BENCHMARKS)))
+
+    data = SyntheticTicks(args.assets, args.ticks, args.days, args.seed)
+    results = []
+    for name in args.benchmarks or BENCHMARKS:
+        print("Running {0}".format(name), file=sys.stderr)
+        for result in BENCHMARKS[name](data, args.repeat):
+            result["group"] = name
+            results.append(result)
+
+    report = {"revision": revision(),
+              "date": datetime.now(timezone.utc).isoformat(),
+              "python": platform.python_version(),
+              "numpy": np.__version__,
+              "machine": platform.machine(),
+              "cpus": os.cpu_count(),
+              "config": {"assets": args.assets, "ticks_per_day": args.ticks, "days": args.days,
+                         "repeat": args.repeat, "seed": args.seed},
+              "results": results}
+    text = json.dumps(report, indent=2)
+    if args.output is not None:
+        with open(args.output, "w") as file:
+            file.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
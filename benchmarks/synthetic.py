@@ -0,0 +1,106 @@
+import lzma
+from datetime import date, datetime, timedelta
+from typing import List
+
+import numpy as np
+import pandas as pd
+import polars as pl
+
+# the downloader modules import each other by their file name, run.py puts their folder on the path
+from processor import TICK_DTYPE
+
+SESSION_START = timedelta(hours=8)
+SESSION_LENGTH_MS = int(8.5 * 3600 * 1000)
+START_DAY = date(2021, 1, 4)
+
+
+class SyntheticTicks(object):
+    def __init__(self, assets: int = 33, ticks_per_day: int = 2500, days: int = 5, seed: int = 0) -> None:
+        """Initialize a deterministic generator of asynchronous tick data.
+
+        Each asset ticks at its own random times during an 8h30 session, with an average of `ticks_per_day` ticks and
+        an activity varying across assets. The log returns follow a one factor model, so the assets are correlated
+        as real stocks, and the same seed always gives the same data.
+
+        Args:
+            assets (int): The number of assets.
+            ticks_per_day (int): The average number of ticks per asset and day.
+            days (int): The number of days.
+            seed (int): The seed of the generator.
+        """
+        self.assets = assets
+        self.ticks_per_day = ticks_per_day
+        self.days = days
+        self.seed = seed
+        rng = np.random.default_rng(seed)
+        self.activity = rng.uniform(0.5, 1.5, assets)
+        self.beta = rng.uniform(0.5, 1.5, assets)
+        self.volatility = rng.uniform(0.01, 0.03, assets)
+
+    def day(self, index: int) -> date:
+        return START_DAY + timedelta(index)
+
+    def _rng(self, *key: int) -> np.random.Generator:
+        return np.random.default_rng([self.seed] + list(key))
+
+    def times(self, asset: int, day: int) -> np.ndarray:
+        """Returns the sorted, distinct tick times of `asset` at `day`, in milliseconds since the session start."""
+        rng = self._rng(asset, day)
+        n = rng.poisson(self.ticks_per_day * self.activity[asset])
+        return np.unique(rng.integers(0, SESSION_LENGTH_MS, n))
+
+    def log_returns(self, day: int) -> List[pd.DataFrame]:
+        """Returns the log returns of every asset at `day`, as the frames given to the BAHC functions."""
+        rng = self._rng(self.assets, day)
+        # the common factor is a random walk sampled at the tick times of every asset
+        grid = np.sort(rng.integers(0, SESSION_LENGTH_MS, 4 * self.ticks_per_day))
+        factor = np.cumsum(rng.normal(0, 1 / np.sqrt(len(grid)), len(grid)))
+        midnight = pd.Timestamp(self.day(day)) + SESSION_START
+        frames = []
+        for asset in range(self.assets):
+            t = self.times(asset, day)
+            common = np.diff(factor[np.searchsorted(grid, t, side='right') - 1], prepend=0)
+            own = self._rng(asset, day, 1).normal(0, 1 / np.sqrt(max(len(t), 1)), len(t))
+            r = self.volatility[asset] * (self.beta[asset] * common + own) / np.sqrt(1 + self.beta[asset] ** 2)
+            frames.append(pd.DataFrame({'logret': r}, index=midnight + pd.to_timedelta(t, unit='ms')))
+        return frames
+
+    def log_returns_range(self) -> List[pd.DataFrame]:
+        """Returns the log returns of every asset over all the days."""
+        days = [self.log_returns(day) for day in range(self.days)]
+        return [pd.concat([frames[asset] for frames in days]) for asset in range(self.assets)]
+
+    def bi5_records(self, asset: int, day: int) -> np.ndarray:
+        """Returns the raw bi5 records of `asset` at `day`: times since midnight, prices in points, volumes."""
+        t = self.times(asset, day)
+        rng = self._rng(asset, day, 2)
+        records = np.zeros(len(t), dtype=TICK_DTYPE)
+        records['time'] = t + SESSION_START // timedelta(milliseconds=1)
+        records['bid'] = 100000 + np.cumsum(rng.integers(-5, 6, len(t)))
+        records['ask'] = records['bid'] + rng.integers(1, 10, len(t))
+        records['ask_volume'] = rng.uniform(0.1, 10, len(t))
+        records['bid_volume'] = rng.uniform(0.1, 10, len(t))
+        return records
+
+    def bi5_payload(self, asset: int, day: int) -> bytes:
+        """Returns the lzma compressed bi5 payload of `asset` at `day`, as served by the data feed."""
+        return lzma.compress(self.bi5_records(asset, day).tobytes())
+
+    def ticks(self, asset: int, day: int) -> pl.DataFrame:
+        """Returns the ticks of `asset` at `day` in the schema written by ParquetDumper."""
+        records = self.bi5_records(asset, day)
+        midnight = datetime.combine(self.day(day), datetime.min.time())
+        return pl.DataFrame({'time (UTC)': pd.Timestamp(midnight) + pd.to_timedelta(records['time'], unit='ms'),
+                             'ask': records['ask'].astype(float) / 1000,
+                             'bid': records['bid'].astype(float) / 1000,
+                             'ask_volume': records['ask_volume'].astype(np.float32),
+                             'bid_volume': records['bid_volume'].astype(np.float32)})
+
+    def covariances(self, samples: int = 100) -> np.ndarray:
+        """Returns one positive definite covariance matrix per day (days, N, N), from `samples` factor model
+        returns, for the cleaning methods which do not need the ticks."""
+        rng = self._rng(self.assets, self.days)
+        common = rng.normal(0, 1, (self.days, samples, 1))
+        own = rng.normal(0, 1, (self.days, samples, self.assets))
+        r = self.volatility * (self.beta * common + own) / np.sqrt(1 + self.beta ** 2)
+        return np.einsum('dti,dtj->dij', r, r) / samples
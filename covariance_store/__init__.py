@@ -0,0 +1,2 @@
+from covariance_store.cube import Cube
+from covariance_store.store import CovarianceStore
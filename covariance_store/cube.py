@@ -0,0 +1,168 @@
+import itertools
+import json
+import os
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+METADATA_FILE_NAME = "cube.json"
+CHUNK_FILE_NAME = "{}.npy"
+DEFAULT_CHUNK_LENGTH = 64
+
+
+class Cube(object):
+    def __init__(self, folder: str, dims: Optional[Sequence[str]] = None, shape: Optional[Sequence[int]] = None,
+                 coords: Optional[Dict[str, List[str]]] = None, chunks: Optional[Sequence[int]] = None,
+                 dtype: str = "float64") -> None:
+        """Open the chunked array stored in `folder`, or create an empty one if the folder holds none.
+
+        The array is split in a grid of chunks, each chunk being a .npy file memory-mapped on access, and described
+        by a JSON sidecar with the names of the dimensions, their labels and the chunk shape. Reading a slice only maps
+        the chunks it intersects and copies the requested entries, so one day of a covariance cube, or one pair over
+        time with chunks spanning few assets, only touches the bytes it needs. The first dimension grows with append.
+
+        Args:
+            folder (str): The folder holding the array.
+            dims (Optional[Sequence[str]]): The names of the dimensions, e.g. ("date", "asset_1", "asset_2").
+                Required to create an array.
+            shape (Optional[Sequence[int]]): The size of every dimension but the first, which starts empty. Taken
+                from the labels when not given.
+            coords (Optional[Dict[str, List[str]]]): The labels of the dimensions, by name. Dimensions without labels
+                are only indexed by position.
+            chunks (Optional[Sequence[int]]): The shape of the chunks. By default DEFAULT_CHUNK_LENGTH entries of the
+                first dimension by the full extent of the others.
+            dtype (str): The data type of the array.
+        """
+        self.folder = folder
+        self.metadata_path = os.path.join(folder, METADATA_FILE_NAME)
+        if os.path.exists(self.metadata_path):
+            with open(self.metadata_path) as file:
+                metadata = json.load(file)
+            self.dims = tuple(metadata["dims"])
+            self.shape = tuple(metadata["shape"])
+            self.coords = metadata["coords"]
+            self.chunks = tuple(metadata["chunks"])
+            self.dtype = np.dtype(metadata["dtype"])
+        else:
+            if dims is None:
+                raise ValueError("No array in {0}, the dimensions are required to create one".format(folder))
+            coords = {name: list(labels) for name, labels in (coords or {}).items()}
+            if shape is None:
+                shape = [len(coords[name]) for name in dims[1:]]
+            self.dims = tuple(dims)
+            self.shape = (0,) + tuple(shape)
+            self.coords = coords
+            self.chunks = tuple(chunks) if chunks is not None else (DEFAULT_CHUNK_LENGTH,) + tuple(shape)
+            self.dtype = np.dtype(dtype)
+            if len(self.shape) != len(self.dims) or len(self.chunks) != len(self.dims):
+                raise ValueError("Expected {0} dimensions for {1}".format(len(self.dims), self.dims))
+            os.makedirs(folder, exist_ok=True)
+            self._write_metadata()
+        self.coords.setdefault(self.dims[0], [])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    @property
+    def ndim(self) -> int:
+        return len(self.dims)
+
+    def __getitem__(self, key) -> np.ndarray:
+        """Read the entries at the positions `key`, with integers, slices or lists of positions per dimension."""
+        key = key if isinstance(key, tuple) else (key,)
+        if len(key) > self.ndim:
+            raise IndexError("Too many indices for {0} dimensions".format(self.ndim))
+        key = key + (slice(None),) * (self.ndim - len(key))
+        positions = [self._positions(k, n) for k, n in zip(key, self.shape)]
+        out = np.empty(tuple(len(p) for p in positions), dtype=self.dtype)
+        # the positions of the output (o) and of the chunk (c) falling in every chunk, per dimension
+        groups = []
+        for p, size in zip(positions, self.chunks):
+            ids = p // size
+            groups.append([(c, np.flatnonzero(ids == c), p[ids == c] - c * size) for c in np.unique(ids)])
+        for block in itertools.product(*groups):
+            chunk = self._chunk(tuple(c for c, _, _ in block), "r")
+            out[np.ix_(*[o for _, o, _ in block])] = chunk[np.ix_(*[p for _, _, p in block])]
+        squeeze = tuple(axis for axis, k in enumerate(key) if np.ndim(k) == 0 and not isinstance(k, slice))
+        return out.squeeze(axis=squeeze) if squeeze else out
+
+    def sel(self, **labels) -> np.ndarray:
+        """Read the entries with the given labels, e.g. sel(date=slice("2021-01-04", "2021-01-29"), asset_1=["A"]).
+
+        A slice of labels includes both ends, a list of labels keeps their order and a single label drops the
+        dimension. The dimensions which are not given are read entirely.
+        """
+        key = []
+        for name in self.dims:
+            label = labels.pop(name, slice(None))
+            index = {value: position for position, value in enumerate(self.coords.get(name, []))}
+            if isinstance(label, slice):
+                start = index[label.start] if label.start is not None else None
+                stop = index[label.stop] + 1 if label.stop is not None else None
+                key.append(slice(start, stop))
+            elif isinstance(label, (list, tuple, np.ndarray)):
+                key.append([index[value] for value in label])
+            else:
+                key.append(index[label])
+        if labels:
+            raise KeyError("Unknown dimensions {0}, expected {1}".format(list(labels), self.dims))
+        return self[tuple(key)]
+
+    def append(self, values: np.ndarray, labels: Optional[List[str]] = None) -> None:
+        """Append entries along the first dimension.
+
+        Args:
+            values (ndarray): The new entries, of shape (k,) + shape[1:].
+            labels (Optional[List[str]]): The labels of the new entries, if the first dimension is labeled.
+        """
+        values = np.asarray(values, dtype=self.dtype)
+        if values.shape[1:] != self.shape[1:]:
+            raise ValueError("Expected entries of shape {0}, got {1}".format(self.shape[1:], values.shape[1:]))
+        start, stop = len(self), len(self) + len(values)
+        first = self.chunks[0]
+        for c0 in range(start // first, -(-stop // first)):
+            lo, hi = max(start, c0 * first), min(stop, (c0 + 1) * first)
+            for block in itertools.product(*[range(-(-n // size)) for n, size in zip(self.shape[1:], self.chunks[1:])]):
+                chunk = self._chunk((c0,) + block, "r+")
+                region = tuple(slice(c * size, (c + 1) * size) for c, size in zip(block, self.chunks[1:]))
+                chunk[(slice(lo - c0 * first, hi - c0 * first),)] = values[(slice(lo - start, hi - start),) + region]
+                chunk.flush()
+        self.shape = (stop,) + self.shape[1:]
+        self.coords[self.dims[0]].extend(labels or [])
+        self._write_metadata()
+
+    def truncate(self, length: int) -> None:
+        """Drop the entries of the first dimension from position `length` on."""
+        self.shape = (min(length, len(self)),) + self.shape[1:]
+        del self.coords[self.dims[0]][len(self):]
+        self._write_metadata()
+
+    def _positions(self, key, n: int) -> np.ndarray:
+        if isinstance(key, slice):
+            return np.arange(n)[key]
+        positions = np.asarray(key, dtype=np.int64).reshape(-1)
+        if np.any((positions < -n) | (positions >= n)):
+            raise IndexError("Index {0} out of bounds for size {1}".format(key, n))
+        return positions % n if n else positions
+
+    def _chunk(self, block: Tuple[int, ...], mode: str) -> np.ndarray:
+        path = os.path.join(self.folder, CHUNK_FILE_NAME.format(".".join(str(c) for c in block)))
+        if mode == "r+" and not os.path.exists(path):
+            # the chunks of the first dimension are allocated whole, the last ones of the others are cut to the shape
+            shape = (self.chunks[0],) + tuple(min(size, n - c * size) for c, size, n in
+                                              zip(block[1:], self.chunks[1:], self.shape[1:]))
+            return np.lib.format.open_memmap(path, mode="w+", dtype=self.dtype, shape=shape)
+        return np.load(path, mmap_mode=mode)
+
+    def _write_metadata(self) -> None:
+        metadata = {"dims": list(self.dims), "shape": list(self.shape), "coords": self.coords,
+                    "chunks": list(self.chunks), "dtype": self.dtype.str}
+        with open(self.metadata_path + ".tmp", "w") as file:
+            json.dump(metadata, file)
+        os.replace(self.metadata_path + ".tmp", self.metadata_path)
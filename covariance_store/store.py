@@ -0,0 +1,160 @@
+import os
+from datetime import date
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+from covariance_store.cube import Cube, METADATA_FILE_NAME
+
+COVARIANCES_FOLDER_NAME = "covariances"
+PREFIX_FOLDER_NAME = "prefix_sums"
+DIMS = ("date", "asset_1", "asset_2")
+
+
+class CovarianceStore(object):
+    def __init__(self, folder: str, assets: Optional[List[str]] = None, chunks: Optional[Sequence[int]] = None) -> None:
+        """Open the rolling covariance store in `folder`, or create it for `assets` if the folder holds none.
+
+        The store keeps the daily covariance matrices in a chunked, memory-mapped cube (date, asset_1, asset_2), next
+        to their prefix sums P[d] = C[0] + ... + C[d - 1]. The sum of any window is then the difference of two prefix
+        sums, so reading a window costs O(N^2) whatever its length, and appending a day writes one matrix to each cube.
+        The difference of two prefix sums carries a rounding error relative to the sum of all the previous days rather
+        than to the window, about days / window * 1e-16 of the window mean, e.g. 1e-14 for 20 years of daily matrices
+        and a monthly window. Non-finite matrices are rejected, as one of them would make every later window NaN.
+        Days are the first dimension so that appending fills the last chunk; `var_cov` gives the (N, N, days) layout
+        of the notebook.
+
+        Args:
+            folder (str): The folder holding the store.
+            assets (Optional[List[str]]): The names of the assets, required to create a store.
+            chunks (Optional[Sequence[int]]): The chunk shape of the cubes, see Cube.
+        """
+        self.folder = folder
+        covariances_folder = os.path.join(folder, COVARIANCES_FOLDER_NAME)
+        if not os.path.exists(os.path.join(covariances_folder, METADATA_FILE_NAME)) and assets is None:
+            raise ValueError("No store in {0}, the assets are required to create one".format(folder))
+        assets = list(assets) if assets is not None else None
+        coords = {"asset_1": assets, "asset_2": assets}
+        self.covariances = Cube(covariances_folder, DIMS, coords=coords, chunks=chunks)
+        if assets is not None and assets != self.covariances.coords["asset_1"]:
+            raise ValueError("The store in {0} holds other assets".format(folder))
+        self.assets = self.covariances.coords["asset_1"]
+        self.N = len(self.assets)
+        self.prefix_sums = Cube(os.path.join(folder, PREFIX_FOLDER_NAME), ("day",) + DIMS[1:], shape=(self.N, self.N),
+                                chunks=chunks)
+        if len(self.prefix_sums) == 0:
+            self.prefix_sums.append(np.zeros((1, self.N, self.N)))
+        # a day appended to one cube and not the other is an interrupted append
+        days = min(len(self.covariances), len(self.prefix_sums) - 1)
+        self.covariances.truncate(days)
+        self.prefix_sums.truncate(days + 1)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def __len__(self) -> int:
+        return len(self.covariances)
+
+    @property
+    def dates(self) -> List[date]:
+        """The day of each matrix."""
+        return [date.fromisoformat(day) for day in self.covariances.coords["date"]]
+
+    @classmethod
+    def from_array(cls, folder: str, var_cov: np.ndarray, dates: List[date], assets: List[str]) -> "CovarianceStore":
+        """Create a store from the (N, N, days) covariance array of the notebook, e.g. cov_all_stocks.pickle.
+
+        Args:
+            folder (str): The folder of the new store.
+            var_cov (ndarray): The daily covariance matrices (N, N, days).
+            dates (List[date]): The day of each matrix.
+            assets (List[str]): The names of the assets.
+
+        Returns:
+            CovarianceStore: The store holding every day of `var_cov`.
+        """
+        store = cls(folder, assets)
+        store.extend(dates, np.moveaxis(var_cov, 2, 0))
+        return store
+
+    @property
+    def var_cov(self) -> np.ndarray:
+        """All the daily covariance matrices, read in the layout of the notebook (N, N, days). Slices of
+        `covariances` read only part of the days or assets."""
+        return np.moveaxis(self.covariances[:], 0, 2)
+
+    def append(self, day: date, covariance: np.ndarray) -> None:
+        """Append the covariance matrix of a new trading day, in O(N^2).
+
+        Args:
+            day (date): The day of the matrix, after the last day of the store.
+            covariance (ndarray): The covariance matrix (N, N).
+        """
+        self.extend([day], covariance[None])
+
+    def extend(self, days: List[date], covariances: np.ndarray) -> None:
+        """Append the covariance matrices of several new trading days.
+
+        Args:
+            days (List[date]): The days of the matrices, in increasing order and after the last day of the store.
+            covariances (ndarray): The covariance matrices (len(days), N, N), finite.
+        """
+        covariances = np.asarray(covariances, dtype=np.float64)
+        if covariances.shape != (len(days), self.N, self.N):
+            raise ValueError("Expected {0} matrices of shape {1}x{1}, got {2}".format(len(days), self.N,
+                                                                                   covariances.shape))
+        if not np.isfinite(covariances).all():
+            raise ValueError("The covariance matrices must be finite, a non-finite day would be in every later "
+                             "prefix sum")
+        last = [date.fromisoformat(day) for day in self.covariances.coords["date"][-1:]]
+        sequence = last + list(days)
+        if any(b <= a for a, b in zip(sequence, sequence[1:])):
+            raise ValueError("The days must be increasing and after {0}".format(last))
+        if not len(days):
+            return
+        prefix = np.cumsum(covariances, axis=0) + self.prefix_sums[-1]
+        self.covariances.append(covariances, [day.isoformat() for day in days])
+        self.prefix_sums.append(prefix)
+
+    def index(self, day: date) -> int:
+        """Returns the position of `day` in the store."""
+        return self.covariances.coords["date"].index(day.isoformat())
+
+    def window_sum(self, end: int, window: int) -> np.ndarray:
+        """Returns the sum of the `window` matrices ending at day `end` included, in O(N^2).
+
+        Args:
+            end (int): The position of the last day of the window. Negative positions count from the end.
+            window (int): The number of days of the window.
+
+        Returns:
+            ndarray: The sum of the matrices of the days end - window + 1 to end (N, N).
+        """
+        if not -len(self) <= end < len(self):
+            raise IndexError("Day {0} is out of the {1} days of the store".format(end, len(self)))
+        if end < 0:
+            end += len(self)
+        end += 1
+        if window < 1 or window > end:
+            raise IndexError("A window of {0} days does not fit before day {1}".format(window, end - 1))
+        return self.prefix_sums[end] - self.prefix_sums[end - window]
+
+    def window_mean(self, end: int, window: int) -> np.ndarray:
+        """Returns the mean of the `window` matrices ending at day `end` included, as
+        var_cov[:, :, end - window + 1:end + 1].mean(axis=2) in the notebook."""
+        return self.window_sum(end, window) / window
+
+    def rolling_means(self, window: int) -> np.ndarray:
+        """Returns the mean of every window of `window` consecutive days.
+
+        Args:
+            window (int): The number of days of the windows.
+
+        Returns:
+            ndarray: The means (days - window + 1, N, N), where entry k averages the days k to k + window - 1.
+        """
+        prefix_sums = self.prefix_sums[:]
+        return (prefix_sums[window:] - prefix_sums[:-window]) / window
@@ -1,15 +1,22 @@
 import asyncio
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor
 from contextlib import ExitStack
 from datetime import timedelta, date
 import calendar
-from typing import List
+from typing import Dict, List, Optional
+
+import polars as pl
 
 from tqdm.auto import tqdm
 
+from cache import RawCache
 from fetch import DataFetcher
+from manifest import Manifest
 from parquet_dumper import ParquetDumper
 from processor import decompress
-from utils import Logger
+from transport import Transport
+from utils import Logger, instrumentation
 
 
 def days(start: date, end: date) -> List[date]:
@@ -49,6 +56,34 @@ def how_many_days(start: date, end: date) -> int:
     return sum(1 for _ in days(start, end))
 
 
+async def decode(symbol: str, day: date, data: bytes, data_fetcher: DataFetcher,
+                 executor: Optional[Executor] = None) -> pl.DataFrame:
+    """
+    Decompresses the data for the given symbol and date in the executor.
+    If the data cannot be decompressed, it is downloaded again until it can.
+
+    Parameters:
+    symbol (str): The symbol of the financial asset.
+    day (date): The date of the data.
+    data (bytes): The binary data to be processed.
+    data_fetcher (DataFetcher): The data fetcher in case we need to re download
+    executor (Optional[Executor]): The executor running the decompression, the loop default one if None.
+
+    Returns:
+        pl.DataFrame: The ticks of the day.
+    """
+    loop = asyncio.get_event_loop()
+    while True:
+        try:
+            with instrumentation.timer("decode"):
+                return await loop.run_in_executor(executor, decompress, symbol, day, data)
+        except Exception as e:
+            instrumentation.count("decode.retries")
+            print(f"Retry download for {symbol} at {day}")
+            data, _ = await data_fetcher.get(symbol, day, refresh=True)
+            print(f"Download finish : continue processing")
+
+
 async def process_and_save_data(symbol: str, day: date, data: bytes, file: ParquetDumper, data_fetcher: DataFetcher):
     """
     Processes and save the data for the given symbol and date, decompressing it and appending it to the provided file.
@@ -61,40 +96,152 @@ async def process_and_save_data(symbol: str, day: date, data: bytes, file: Parqu
     file (ParquetDumper): The file to append the processed data to.
     data_fetcher (DataFetcher): The data fetcher in case we need to re download
     """
-    try:
-        decompressed_data = await asyncio.get_event_loop().run_in_executor(None, decompress, symbol, day, data)
-        file.append(day, decompressed_data)
-    except Exception as e:
-        print(f"Retry download for {symbol} at {day}")
-        retry_response = await data_fetcher.get(symbol, day)
-        print(f"Download finish : continue processing")
-        await process_and_save_data(symbol, day ,retry_response, file, data_fetcher)
+    file.append(day, await decode(symbol, day, data, data_fetcher))
+
+
+async def pipeline(pending: Dict[str, List[date]], files: Dict[str, ParquetDumper], data_fetcher: DataFetcher,
+                   progress_bar: tqdm, concurrency: int, executor: Executor, processes: int,
+                   queue_size: int) -> None:
+    """
+    Streams every pending (symbol, day) through three overlapping stages: download, decompression and dump.
 
+    The stages are connected by bounded queues. When the decompression or the dump falls behind, the queues fill up
+    and the downloads wait, so the memory does not grow with the date range: at most `queue_size` payloads and
+    `queue_size` frames wait in the queues, plus one payload held by each download blocked on a full queue (up to
+    `concurrency` compressed payloads), one frame per decompression and the frame being written.
+    If a stage fails, the other stages are cancelled and the error is raised, instead of the others waiting forever
+    on queues nobody consumes.
 
-def app(symbols: List[str], start: date, end: date, threads: int, folder: str) -> None:
+    Parameters:
+    pending (Dict[str, List[date]]): The days to fetch for each symbol.
+    files (Dict[str, ParquetDumper]): The file of each symbol.
+    data_fetcher (DataFetcher): The data fetcher.
+    progress_bar (tqdm): progress bar object to display the progress of the download.
+    concurrency (int): The number of concurrent downloads.
+    executor (Executor): The process pool running the decompression.
+    processes (int): The number of concurrent decompressions.
+    queue_size (int): The capacity of the queues between the stages.
+    """
+    work = [(symbol, day) for symbol, symbol_days in pending.items() for day in symbol_days]
+    work.reverse()
+    compressed = asyncio.Queue(maxsize=queue_size)
+    decompressed = asyncio.Queue(maxsize=queue_size)
+    loop = asyncio.get_event_loop()
+
+    async def download():
+        while work:
+            symbol, day = work.pop()
+            data, _ = await data_fetcher.get(symbol, day)
+            progress_bar.update()
+            progress_bar.set_description(data_fetcher.status())
+            await compressed.put((symbol, day, data))
+
+    async def decompress_stage():
+        while True:
+            item = await compressed.get()
+            if item is None:
+                return
+            symbol, day, data = item
+            await decompressed.put((symbol, day, await decode(symbol, day, data, data_fetcher, executor)))
+
+    async def dump_stage():
+        while True:
+            item = await decompressed.get()
+            if item is None:
+                return
+            symbol, day, ticks = item
+            # the writes happen in a thread so the event loop keeps downloading, one at a time
+            await loop.run_in_executor(None, files[symbol].append, day, ticks)
+
+    async def close():
+        await asyncio.gather(*downloads)
+        for _ in decoders:
+            await compressed.put(None)
+        await asyncio.gather(*decoders)
+        await decompressed.put(None)
+        await dumper
+
+    decoders = [loop.create_task(decompress_stage()) for _ in range(processes)]
+    dumper = loop.create_task(dump_stage())
+    downloads = [loop.create_task(download()) for _ in range(min(concurrency, len(work)))]
+    tasks = downloads + decoders + [dumper, loop.create_task(close())]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        for task in done:
+            if not task.cancelled() and task.exception() is not None:
+                raise task.exception()
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+@instrumentation.timed("app")
+def app(symbols: List[str], start: date, end: date, threads: int, folder: str,
+        buffer_bytes: Optional[int] = None, force: bool = False, cache: Optional[str] = None,
+        cache_bytes: Optional[int] = None, processes: Optional[int] = None, queue_size: Optional[int] = None,
+        two_phase: bool = False, transport: Optional[Transport] = None, max_rate: Optional[float] = None,
+        partitioned: bool = False) -> None:
     """Fetches and processes data for the given symbols, dates, and threads, and stores the results in the given folder.
 
+        The downloads are recorded in a manifest next to the results, and the days already persisted by a previous
+        run are skipped, so re-running a range only requests the missing or failed days.
+        Downloads, decompression (in a process pool) and writes overlap in a pipeline with bounded memory. The
+        former design, which downloads everything before decompressing, is kept with `two_phase`.
+
         Args:
             symbols (List[str]): The symbols to fetch data for.
             start (date): The start date.
             end (date): The end date.
-            threads (int): The number of threads to use.
+            threads (int): The maximum number of concurrent requests per host.
             folder (str): The folder to store the results in.
+            buffer_bytes (Optional[int]): If given, each symbol file is written incrementally once its buffered
+                days exceed this many bytes, instead of keeping the whole range in memory.
+            force (bool): Download every day again, even the ones already persisted.
+            cache (Optional[str]): If given, the folder of the raw payload cache, consulted before the network.
+            cache_bytes (Optional[int]): The size cap of the raw payload cache.
+            processes (Optional[int]): The number of decompression processes, the number of cores by default.
+            queue_size (Optional[int]): The capacity of the queues between the stages, 4 per process by default.
+            two_phase (bool): Download everything, then decompress and write.
+            transport (Optional[Transport]): How the payloads are fetched, the public proxy pool by default.
+            max_rate (Optional[float]): If given, the maximum number of requests started per second per host.
+            partitioned (bool): Write a Hive-partitioned dataset symbol=/year=/month= instead of one file per symbol.
         """
     if start > end:
         return
-    total_days = how_many_days(start, end) * len(symbols)
-
-    if total_days == 0:
-        return
-
-    with tqdm(total=total_days) as progress_bar, DataFetcher(threads) as data_fetcher:
-        responses = data_fetcher.fetch(symbols, days(start, end), progress_bar)
-        with ExitStack() as stack:
-            files = [stack.enter_context(ParquetDumper(symbol, start, end, folder)) for symbol in symbols]
-            loop = asyncio.get_event_loop()
-            tasks = [loop.create_task(process_and_save_data(symbol,tuple_data_day[1], tuple_data_day[0], file, data_fetcher))
-                     for symbol_responses, file, symbol in zip(responses, files, symbols)
-                     for tuple_data_day in symbol_responses]
-            loop.run_until_complete(asyncio.gather(*tasks))
+    trading_days = days(start, end)
+
+    raw_cache = RawCache(cache, cache_bytes) if cache is not None else None
+    with Manifest(folder) as manifest:
+        pending = {symbol: trading_days if force else manifest.pending(symbol, trading_days) for symbol in symbols}
+        symbols = [symbol for symbol in symbols if pending[symbol]]
+        total_days = sum(len(pending[symbol]) for symbol in symbols)
+
+        if total_days == 0:
+            Logger.info("Every day is already downloaded")
+            return
+
+        with tqdm(total=total_days) as progress_bar, \
+                DataFetcher(threads, manifest, resume=not force, cache=raw_cache, transport=transport,
+                            max_rate=max_rate) as data_fetcher:
+            if two_phase:
+                responses = data_fetcher.fetch(symbols, trading_days, progress_bar)
+            with ExitStack() as stack:
+                files = [stack.enter_context(ParquetDumper(symbol, start, end, folder, max_buffer_bytes=buffer_bytes,
+                                                           days=pending[symbol], manifest=manifest,
+                                                           overwrite=force, partitioned=partitioned))
+                         for symbol in symbols]
+                loop = asyncio.get_event_loop()
+                if two_phase:
+                    tasks = [loop.create_task(process_and_save_data(symbol,tuple_data_day[1], tuple_data_day[0], file, data_fetcher))
+                             for symbol_responses, file, symbol in zip(responses, files, symbols)
+                             for tuple_data_day in symbol_responses]
+                    loop.run_until_complete(asyncio.gather(*tasks))
+                else:
+                    workers = processes if processes is not None else os.cpu_count()
+                    with ProcessPoolExecutor(workers) as executor:
+                        loop.run_until_complete(pipeline(
+                            {symbol: pending[symbol] for symbol in symbols}, dict(zip(symbols, files)),
+                            data_fetcher, progress_bar, threads, executor, workers,
+                            queue_size if queue_size is not None else 4 * workers))
     Logger.info("Fetching data terminated")
@@ -0,0 +1,68 @@
+import os
+from collections import OrderedDict
+from typing import Optional
+from urllib.parse import urlsplit
+
+from utils import Logger
+
+
+class RawCache(object):
+    def __init__(self, folder: str, max_bytes: Optional[int] = None) -> None:
+        """Initialize an on-disk cache of the raw compressed bi5 payloads.
+
+        A payload is stored under the path of its URL, i.e. `folder/{symbol}/{year}/{month}/{day}_ticks.bi5`, so the
+        cache is also a local mirror of the data feed. When the cache exceeds `max_bytes`, the least recently used
+        payloads are removed. The access order is kept in the modification time of the files, so it survives runs.
+
+        Args:
+            folder (str): The folder holding the cached payloads.
+            max_bytes (Optional[int]): The maximum size of the cache, unbounded by default.
+        """
+        self.folder = folder
+        self.max_bytes = max_bytes
+        entries = []
+        for root, _, files in os.walk(folder):
+            for name in files:
+                if name.endswith(".bi5"):
+                    stat = os.stat(os.path.join(root, name))
+                    entries.append((stat.st_mtime, os.path.relpath(os.path.join(root, name), folder), stat.st_size))
+        self.entries = OrderedDict((key, size) for _, key, size in sorted(entries))
+        self.size = sum(self.entries.values())
+
+    @staticmethod
+    def key(url: str) -> str:
+        """Returns the path of the payload of `url` relative to the cache folder, e.g. EURUSD/2016/01/02_ticks.bi5."""
+        path = urlsplit(url).path.strip("/")
+        return os.path.join(*path.split("/")[-4:])
+
+    def get(self, url: str) -> Optional[bytes]:
+        """Returns the cached payload of `url`, or None if it is not cached."""
+        key = self.key(url)
+        if key not in self.entries:
+            return None
+        path = os.path.join(self.folder, key)
+        try:
+            with open(path, "rb") as file:
+                data = file.read()
+        except OSError:
+            self.size -= self.entries.pop(key)
+            return None
+        os.utime(path)
+        self.entries.move_to_end(key)
+        Logger.info("Cache hit {0}".format(key))
+        return data
+
+    def put(self, url: str, data: bytes) -> None:
+        """Store the payload of `url` and evict the least recently used payloads above the size cap."""
+        key = self.key(url)
+        path = os.path.join(self.folder, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "wb") as file:
+            file.write(data)
+        os.replace(path + ".tmp", path)
+        self.size += len(data) - self.entries.pop(key, 0)
+        self.entries[key] = len(data)
+        while self.max_bytes is not None and self.size > self.max_bytes and len(self.entries) > 1:
+            old_key, old_size = self.entries.popitem(last=False)
+            os.remove(os.path.join(self.folder, old_key))
+            self.size -= old_size
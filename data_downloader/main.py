@@ -4,6 +4,7 @@ import argparse
 from datetime import date, timedelta
 
 from app import app
+from transport import get_transport
 from utils import valid_date, set_up_signals
 
 VERSION = '0.2.1'
@@ -19,8 +20,28 @@ def main():
                         default=date.today() - timedelta(1))
     parser.add_argument('-s', '--startdate', type=valid_date, help='start date format YYYY-MM-DD (default today)')
     parser.add_argument('-e', '--enddate', type=valid_date, help='end date format YYYY-MM-DD (default today)')
-    parser.add_argument('-t', '--thread', type=int, help='number of threads (default 1000)', default=1000)
+    parser.add_argument('-t', '--thread', type=int, help='maximum number of concurrent requests (default 1000)',
+                        default=1000)
     parser.add_argument('-f', '--folder', type=str, help='destination folder (default .)', default='.')
+    parser.add_argument('-b', '--buffer', type=int,
+                        help='write each file incrementally once BUFFER MB of ticks are buffered (default keep all)')
+    parser.add_argument('--force', action='store_true',
+                        help='download again the days already saved in FOLDER (default only the missing days)')
+    parser.add_argument('-c', '--cache', type=str,
+                        help='folder of the raw bi5 cache, looked up before downloading (default no cache)')
+    parser.add_argument('--cache-size', type=int, help='size cap of the raw bi5 cache in MB (default unbounded)')
+    parser.add_argument('-p', '--processes', type=int,
+                        help='number of decompression processes (default number of cores)')
+    parser.add_argument('--two-phase', action='store_true',
+                        help='download everything before decompressing, instead of overlapping both')
+    parser.add_argument('--transport', choices=['proxy', 'direct', 'mirror'], default='proxy',
+                        help='proxy: public proxy pool, direct: plain HTTP to the feed or to --mirror URL, '
+                             'mirror: local --mirror folder (default proxy)')
+    parser.add_argument('--mirror', type=str, help='URL or folder of a mirror of the data feed')
+    parser.add_argument('--partitioned', action='store_true',
+                        help='write a dataset partitioned by symbol, year and month, where new downloads replace '
+                             'their days (default one file per symbol and run)')
+    parser.add_argument('--max-rate', type=float, help='maximum number of requests per second per host (default none)')
     args = parser.parse_args()
 
     if args.startdate is not None:
@@ -34,7 +55,11 @@ def main():
         end = args.day
 
     set_up_signals()
-    app(args.symbols, start, end, args.thread, args.folder)
+    buffer_bytes = args.buffer * 1024 ** 2 if args.buffer is not None else None
+    cache_bytes = args.cache_size * 1024 ** 2 if args.cache_size is not None else None
+    app(args.symbols, start, end, args.thread, args.folder, buffer_bytes, args.force, args.cache, cache_bytes,
+        args.processes, two_phase=args.two_phase, transport=get_transport(args.transport, args.thread, args.mirror),
+        max_rate=args.max_rate, partitioned=args.partitioned)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,89 @@
+import hashlib
+import os
+import sqlite3
+import time
+from datetime import date
+from typing import Dict, List
+
+from utils import Logger
+
+MANIFEST_FILE_NAME = ".manifest.sqlite"
+
+FETCHED = "fetched"
+FAILED = "failed"
+PERSISTED = "persisted"
+
+
+class Manifest(object):
+    def __init__(self, folder: str) -> None:
+        """Initialize the manifest of the downloads stored in `folder`.
+
+        The manifest is a SQLite index next to the output files, with one entry per (symbol, day) recording its
+        status ("fetched", "failed" or "persisted"), the checksum of the downloaded payload, the number of rows
+        written and the file holding them. Only persisted days are considered complete.
+
+        Args:
+            folder (str): The folder where the data is saved.
+        """
+        self.path = os.path.join(folder, MANIFEST_FILE_NAME)
+
+    def __enter__(self):
+        self.connection = sqlite3.connect(self.path)
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS days (
+                                       symbol TEXT NOT NULL,
+                                       day TEXT NOT NULL,
+                                       status TEXT NOT NULL,
+                                       checksum TEXT,
+                                       rows INTEGER,
+                                       file TEXT,
+                                       updated REAL NOT NULL,
+                                       PRIMARY KEY (symbol, day))""")
+        return self
+
+    def __exit__(self, *args):
+        self.connection.commit()
+        self.connection.close()
+
+    def pending(self, symbol: str, days: List[date]) -> List[date]:
+        """Returns the days of `days` that are not persisted yet for `symbol`.
+
+        Args:
+            symbol (str): The symbol of the financial asset.
+            days (List[date]): The requested days.
+
+        Returns:
+            List[date]: The missing or failed days, in the order of `days`.
+        """
+        done = {row[0] for row in self.connection.execute(
+            "SELECT day FROM days WHERE symbol = ? AND status = ?", (symbol, PERSISTED))}
+        return [day for day in days if day.isoformat() not in done]
+
+    def mark_fetched(self, symbol: str, day: date, data: bytes) -> None:
+        """Record that the payload of `symbol` at `day` was downloaded, with its sha256 checksum."""
+        self._set(symbol, day, FETCHED, hashlib.sha256(data).hexdigest())
+
+    def mark_failed(self, symbol: str, day: date) -> None:
+        """Record that the download of `symbol` at `day` failed, so that the next run requests it again."""
+        self._set(symbol, day, FAILED, None)
+
+    def mark_persisted(self, symbol: str, rows: Dict[date, int], file: str) -> None:
+        """Record that the fetched days of `rows` are written in `file`. Failed days stay failed.
+
+        Args:
+            symbol (str): The symbol of the financial asset.
+            rows (Dict[date, int]): The number of rows written for each day.
+            file (str): The name of the file holding the days.
+        """
+        now = time.time()
+        self.connection.executemany(
+            "UPDATE days SET status = ?, rows = ?, file = ?, updated = ? WHERE symbol = ? AND day = ? AND status = ?",
+            [(PERSISTED, n, file, now, symbol, day.isoformat(), FETCHED) for day, n in rows.items()])
+        self.connection.commit()
+        Logger.info("Manifest: {0} days of {1} persisted in {2}".format(len(rows), symbol, file))
+
+    def _set(self, symbol: str, day: date, status: str, checksum) -> None:
+        self.connection.execute(
+            """INSERT INTO days (symbol, day, status, checksum, updated) VALUES (?, ?, ?, ?, ?)
+               ON CONFLICT (symbol, day) DO UPDATE SET status = excluded.status, checksum = excluded.checksum,
+                                                       updated = excluded.updated""",
+            (symbol, day.isoformat(), status, checksum, time.time()))
@@ -1,33 +1,81 @@
-import polars as pl
-from utils import Logger
+import os
+import shutil
 from datetime import date
+from typing import List, Optional
+
+import polars as pl
+from manifest import Manifest
+from utils import Logger, instrumentation
 
 
 TEMPLATE_FILE_NAME = "{}-{}_{:02d}_{:02d}-{}_{:02d}_{:02d}.parquet"
+PARTITION_TEMPLATE = os.path.join("symbol={}", "year={}", "month={:02d}")
+PARTITION_FILE_NAME = "data.parquet"
+# about a trading day of a liquid stock, so that date filters skip most row groups of a partition
+ROW_GROUP_ROWS = 2 ** 17
+SCHEMA = [("time (UTC)", pl.Datetime), ("ask", pl.Float64), ("bid", pl.Float64),
+          ("ask_volume", pl.Float32), ("bid_volume", pl.Float32)]
 
 
 class ParquetDumper(object):
-    def __init__(self, symbol: str, start: date, end: date, folder: str) -> None:
+    def __init__(self, symbol: str, start: date, end: date, folder: str, max_buffer_rows: Optional[int] = None,
+                 max_buffer_bytes: Optional[int] = None, days: Optional[List[date]] = None,
+                 manifest: Optional[Manifest] = None, overwrite: bool = True, partitioned: bool = False) -> None:
         """Initialize a new ParquetDumper instance.
 
+        By default every day is kept in memory and written at exit. If a row or byte budget is given, the dumper
+        streams: once the buffer exceeds the budget, the days that are complete and in date order are written to the
+        file as a row group, and out of order days are spilled to disk until the days before them arrive.
+
         Args:
             symbol (str): The symbol to dump.
             start (date): The start date of the data.
             end (date): The end date of the data.
             folder (str): The folder to save the dumped data in.
+            max_buffer_rows (Optional[int]): Number of buffered rows above which the buffer is flushed.
+            max_buffer_bytes (Optional[int]): Estimated buffered bytes above which the buffer is flushed.
+            days (Optional[List[date]]): The days that will be appended, used to know which days are in order.
+                Without it, every flush is spilled and the file is sorted at exit.
+            manifest (Optional[Manifest]): If given, the appended days are recorded as persisted once the file is
+                written.
+            overwrite (bool): If False and the file already exists, a numbered suffix is added to the new file name.
+                The name is picked when the first rows are written, and no file is written without rows.
+            partitioned (bool): Write a Hive-partitioned dataset `symbol=/year=/month=/data.parquet` instead of one
+                file per run. Each month is sorted by time, and the days appended replace the same days already in
+                their partition. In streaming mode, a month is written as soon as all its days are appended.
         """
         self.symbol = symbol
         self.start = start
         self.end = end
         self.folder = folder
+        self.max_buffer_rows = max_buffer_rows
+        self.max_buffer_bytes = max_buffer_bytes
+        self.days = sorted(days) if days is not None else []
+        self.streaming = max_buffer_rows is not None or max_buffer_bytes is not None
+        self.manifest = manifest
+        self.partitioned = partitioned
+        self.overwrite = overwrite
+        self.base_name = TEMPLATE_FILE_NAME.format(self.symbol,
+                                                   self.start.year, self.start.month, self.start.day,
+                                                   self.end.year, self.end.month, self.end.day)
+        self.file_name = self.base_name
+        self.path = os.path.join(self.folder, self.file_name)
 
     def __enter__(self):
         self.buffer = {}
+        self.completed = {}
+        self.spilled = set()
+        self.partitioned_days = set()
+        self.next_day = 0
+        self.writer = None
         return self
 
     def __exit__(self, *args):
         self.dump()
         self.buffer = {}
+        if self.manifest is not None:
+            file_name = "symbol={}".format(self.symbol) if self.partitioned else self.file_name
+            self.manifest.mark_persisted(self.symbol, self.completed, file_name)
 
     def append(self, day: date, ticks: pl.DataFrame) -> None:
         """Append data for a specific day to the buffer.
@@ -36,26 +84,175 @@ class ParquetDumper(object):
             day (date): The day of the data.
             ticks (pl.DataFame),: The data to append.
         """
+        self.completed[day] = ticks.height
+        instrumentation.count("dump.rows", ticks.height)
+        if day in self.spilled:
+            os.remove(self._spill_path(day))
+            self.spilled.discard(day)
         if not ticks.is_empty():
             self.buffer[day] = ticks
+        if self.streaming and self._over_budget():
+            if self.partitioned:
+                self._flush_months()
+            else:
+                self._flush_ready()
+            if self._over_budget():
+                self._spill()
 
+    @instrumentation.timed("dump")
     def dump(self) -> None:
         """Dump the data in the buffer to a Parquet file.
 
                The file will be saved in the folder specified in the constructor, with a name generated using the TEMPLATE_FILE_NAME
                template and the symbol, start date, and end date specified in the constructor.
         """
-        file_name = TEMPLATE_FILE_NAME.format(self.symbol,
-                                              self.start.year, self.start.month, self.start.day,
-                                              self.end.year, self.end.month, self.end.day)
+        if self.partitioned:
+            # the months of the re-downloaded days which are now empty are rewritten too
+            rewritten = [day for day in self.completed if day not in self.partitioned_days and
+                         os.path.exists(os.path.join(self.folder, self._partition(day), PARTITION_FILE_NAME))]
+            self._write_months(sorted(self.spilled | set(self.buffer)), rewritten)
+            shutil.rmtree(self._spill_folder(), ignore_errors=True)
+            return
 
-        Logger.info("Writing {0}".format(file_name))
+        if self.streaming:
+            self._write(sorted(self.spilled | set(self.buffer)))
+            if self.writer is None:
+                Logger.info("No tick of {0} to write".format(self.symbol))
+                return
+            self.writer.close()
+            os.replace(self.path + ".part", self.path)
+            shutil.rmtree(self._spill_folder(), ignore_errors=True)
+            Logger.info("{0} completed".format(self.file_name))
+            return
 
-        df = pl.DataFrame(columns=[('ask', pl.Float64), ('bid', pl.Float64),
-                                   ('ask_volume', pl.Float32), ('bid_volume', pl.Float32),
-                                   ('time (UTC)', pl.Datetime)])
+        if not self.buffer:
+            Logger.info("No tick of {0} to write".format(self.symbol))
+            return
+        self._name_file()
+        Logger.info("Writing {0}".format(self.file_name))
+        df = pl.DataFrame(schema=SCHEMA)
         for day in sorted(self.buffer.keys()):
-            df.vstack(self.buffer[day], in_place=True)
-        df = df.select(["time (UTC)", "ask", "bid", "ask_volume", "bid_volume"])
-        df.write_parquet(self.folder + "/" + file_name, compression="lz4")
-        Logger.info("{0} completed".format(file_name))
+            df.vstack(self._standardize(self.buffer[day]), in_place=True)
+        df.write_parquet(self.path, compression="lz4")
+        Logger.info("{0} completed".format(self.file_name))
+
+    @staticmethod
+    def _standardize(ticks: pl.DataFrame) -> pl.DataFrame:
+        return ticks.select([pl.col(name).cast(dtype) for name, dtype in SCHEMA])
+
+    def _over_budget(self, frames: Optional[List[pl.DataFrame]] = None) -> bool:
+        frames = list(self.buffer.values()) if frames is None else frames
+        if self.max_buffer_rows is not None and sum(df.height for df in frames) > self.max_buffer_rows:
+            return True
+        return self.max_buffer_bytes is not None and sum(df.estimated_size() for df in frames) > self.max_buffer_bytes
+
+    def _flush_ready(self) -> None:
+        """Write the buffered and spilled days that directly follow the last written day."""
+        ready = []
+        while self.next_day < len(self.days) and self.days[self.next_day] in self.completed:
+            ready.append(self.days[self.next_day])
+            self.next_day += 1
+        self._write([day for day in ready if day in self.buffer or day in self.spilled])
+
+    def _flush_months(self) -> None:
+        """Write the months of which every day has been appended."""
+        pending = {self._month(day) for day in self.days if day not in self.completed}
+        self._write_months([day for day in sorted(self.spilled | set(self.buffer)) if self._month(day) not in pending])
+
+    def _write_months(self, days: List[date], rewritten: Optional[List[date]] = None) -> None:
+        months = {self._month(day): [] for day in rewritten or []}
+        for day in days:
+            months.setdefault(self._month(day), []).append(day)
+        for month, month_days in months.items():
+            self._write_partition(month, month_days)
+
+    @instrumentation.timed("dump.partition")
+    def _write_partition(self, month, days: List[date]) -> None:
+        """Merge the buffered and spilled `days` of `month` into its partition, replacing the days appended."""
+        folder = os.path.join(self.folder, self._partition(date(month[0], month[1], 1)))
+        path = os.path.join(folder, PARTITION_FILE_NAME)
+        Logger.info("Writing {0}".format(folder))
+        frames = [self._take(day) for day in days]
+        if os.path.exists(path):
+            # every day appended since the last write of the month replaces its old rows, even if it is now empty
+            replaced = [day for day in self.completed
+                        if self._month(day) == month and day not in self.partitioned_days]
+            frames.append(pl.read_parquet(path).filter(~pl.col("time (UTC)").dt.date().is_in(replaced)))
+        self.partitioned_days.update(day for day in self.completed if self._month(day) == month)
+        ticks = pl.concat(frames).sort("time (UTC)") if frames else pl.DataFrame(schema=SCHEMA)
+        if ticks.is_empty():
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        os.makedirs(folder, exist_ok=True)
+        ticks.write_parquet(path + ".part", compression="lz4", statistics=True, row_group_size=ROW_GROUP_ROWS)
+        os.replace(path + ".part", path)
+
+    def _take(self, day: date) -> pl.DataFrame:
+        """Remove `day` from the buffer or the spill folder and return it."""
+        if day in self.spilled:
+            frame = pl.read_parquet(self._spill_path(day))
+            os.remove(self._spill_path(day))
+            self.spilled.discard(day)
+            return frame
+        return self._standardize(self.buffer.pop(day))
+
+    def _partition(self, day: date) -> str:
+        return PARTITION_TEMPLATE.format(self.symbol, day.year, day.month)
+
+    @staticmethod
+    def _month(day: date):
+        return day.year, day.month
+
+    def _write(self, days: List[date]) -> None:
+        if not days:
+            return
+        if self.writer is None:
+            self._open_writer()
+        frames = []
+        for day in days:
+            frames.append(self._take(day))
+            # one row group per budget worth of days
+            if self._over_budget(frames):
+                self._write_row_group(frames)
+                frames = []
+        if frames:
+            self._write_row_group(frames)
+
+    @instrumentation.timed("dump.row_group")
+    def _write_row_group(self, frames: List[pl.DataFrame]) -> None:
+        table = pl.concat(frames).to_arrow()
+        self.writer.write_table(table, row_group_size=table.num_rows)
+
+    def _name_file(self) -> None:
+        """Pick the name of the file, numbered if a file of the same range exists and must not be overwritten."""
+        copy = 0
+        while not self.overwrite and os.path.exists(os.path.join(self.folder, self.file_name)):
+            copy += 1
+            self.file_name = TEMPLATE_FILE_NAME.replace(".parquet", "-{}.parquet").format(
+                self.symbol, self.start.year, self.start.month, self.start.day,
+                self.end.year, self.end.month, self.end.day, copy)
+        self.path = os.path.join(self.folder, self.file_name)
+
+    def _open_writer(self) -> None:
+        import pyarrow.parquet as pq
+
+        self._name_file()
+        Logger.info("Writing {0}".format(self.file_name))
+        schema = pl.DataFrame(schema=SCHEMA).to_arrow().schema
+        self.writer = pq.ParquetWriter(self.path + ".part", schema, compression="lz4")
+
+    @instrumentation.timed("dump.spill")
+    def _spill(self) -> None:
+        """Move the buffered days, which cannot be written yet, to one temporary file per day."""
+        os.makedirs(self._spill_folder(), exist_ok=True)
+        for day, ticks in self.buffer.items():
+            self._standardize(ticks).write_parquet(self._spill_path(day), compression="lz4")
+            self.spilled.add(day)
+        self.buffer = {}
+
+    def _spill_folder(self) -> str:
+        return os.path.join(self.folder, "." + self.base_name + ".spill")
+
+    def _spill_path(self, day: date) -> str:
+        return os.path.join(self._spill_folder(), day.isoformat() + ".parquet")
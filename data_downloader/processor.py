@@ -4,6 +4,10 @@ import polars as pl
 import numpy as np
 from utils import Logger
 
+# One bi5 record: milliseconds since midnight, ask and bid in points, ask and bid volumes, all big-endian
+TICK_DTYPE = np.dtype([('time', '>u4'), ('ask', '>u4'), ('bid', '>u4'), ('ask_volume', '>f4'), ('bid_volume', '>f4')])
+POINT = 1000  # Normalization factor
+
 
 def bytes_to_data(buffer: bytes) -> pl.DataFrame:
     """Convert a byte buffer to a polars DataFrame.
@@ -24,6 +28,35 @@ def bytes_to_data(buffer: bytes) -> pl.DataFrame:
     return df
 
 
+def bytes_to_ticks(day: date, buffer: bytes, point: int = POINT) -> pl.DataFrame:
+    """Convert a byte buffer to the standardized polars DataFrame in a single pass.
+
+    The buffer is viewed as an array of records without copying, and each column is converted to its final native
+    type with one copy, then scaled in place. It is equivalent to standardize(day, bytes_to_data(buffer)).
+
+    Args:
+        day (date): The day of the data.
+        buffer (bytes): A byte buffer of bi5 records.
+        point (int): The normalization factor of the prices.
+
+    Returns:
+        A polars DataFrame with columns "time (UTC)", "ask", "bid", "ask_volume", and "bid_volume".
+    """
+    records = np.frombuffer(buffer, dtype=TICK_DTYPE)
+
+    time = records['time'].astype(np.int64)
+    time *= 1000
+    time += np.datetime64(day, 'us').astype(np.int64)
+    ask = records['ask'].astype(np.float64)
+    ask /= point
+    bid = records['bid'].astype(np.float64)
+    bid /= point
+
+    return pl.DataFrame({'time (UTC)': time.view('datetime64[us]'), 'ask': ask, 'bid': bid,
+                         'ask_volume': records['ask_volume'].astype(np.float32),
+                         'bid_volume': records['bid_volume'].astype(np.float32)})
+
+
 def standardize(day: date, ticks: pl.DataFrame) -> pl.DataFrame:
     """Standardize the prices in a polars DataFrame and create the date times.
 
@@ -34,7 +67,7 @@ def standardize(day: date, ticks: pl.DataFrame) -> pl.DataFrame:
     Returns:
         The input DataFrame with the "ask" and "bid" columns divided by 1000 and a correct datetime "time (UTC)" colum.
     """
-    point = 1000  # Normalization factor
+    point = POINT
     ticks = ticks.with_columns(
         [(pl.duration(milliseconds="time") + pl.datetime(day.year, day.month, day.day)).alias("time (UTC)"),
          pl.col("ask") / point, pl.col("bid") / point])
@@ -51,14 +84,14 @@ def decompress(symbol : str, day: date, compressed_buffer: bytes) -> pl.DataFram
         compressed_buffer (byte): A LZMA-compressed byte buffer.
 
     Returns:
-        A polars DataFrame with columns "time", "ask", "bid", "ask_volume", and "bid_volume". If the input buffer is empty,
-        an empty DataFrame is returned.
+        A polars DataFrame with columns "time (UTC)", "ask", "bid", "ask_volume", and "bid_volume". If the input buffer
+        is empty, an empty DataFrame is returned.
     Raises:
         Exception: If the data fails to be decompressed and converted.
     """
     # Check if the buffer is empty
     if not compressed_buffer:
-        return pl.DataFrame(columns=["time", "ask", "bid", "ask_volume", "bid_volume"])
+        return bytes_to_ticks(day, b'')
 
     # Attempt to decompress the buffer
     try:
@@ -69,4 +102,4 @@ def decompress(symbol : str, day: date, compressed_buffer: bytes) -> pl.DataFram
         print(f"Error decompressing buffer of date {day} and symbol {symbol}: {e}")
         raise Exception(f"Could not decompress")
     # Convert the decompressed
-    return standardize(day, bytes_to_data(decompressed_buffer))
+    return bytes_to_ticks(day, decompressed_buffer)
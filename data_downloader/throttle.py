@@ -0,0 +1,177 @@
+import asyncio
+import random
+import time
+from collections import deque
+from typing import Dict, Optional
+
+BACKOFF_BASE = 0.05  # seconds before the first retry, doubled at each attempt
+BACKOFF_CAP = 2
+LATENCY_TOLERANCE = 2  # a smoothed latency above LATENCY_TOLERANCE x the long-run one signals congestion
+SMOOTHING = 0.1  # largest weight of a new latency in the smoothed latency, which averages at least 10 requests
+MIN_LATENCY = 1e-6  # seconds, the floor of the measured latencies
+BASELINE_ROUNDS = 100  # number of rounds of `limit` requests averaged by the long-run latency
+SLOW_START_TOLERANCE = 1.5  # a smoothed latency above SLOW_START_TOLERANCE x the long-run one ends the slow start
+DECREASE_FACTOR = 0.5
+OUTCOME_WINDOW = 100  # number of recent requests used for the error rate
+LATENCY_WINDOW = 1000  # number of recent latencies used for the percentiles
+
+
+def backoff(attempt: int, base: float = BACKOFF_BASE, cap: float = BACKOFF_CAP) -> float:
+    """Returns the delay before retry number `attempt` (from 1): exponential backoff with full jitter.
+
+    Args:
+        attempt (int): The number of the retry.
+        base (float): The delay scale of the first retry, in seconds.
+        cap (float): The maximum delay, in seconds.
+
+    Returns:
+        float: A delay drawn uniformly between 0 and min(cap, base * 2 ** (attempt - 1)).
+    """
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+class AdaptiveLimiter(object):
+    def __init__(self, max_limit: int, min_limit: int = 1, initial_limit: int = 16, max_error_rate: float = 0.1,
+                 max_rate: Optional[float] = None, latency_signal: bool = True) -> None:
+        """Initialize an AIMD limiter of the concurrent requests to one host.
+
+        The limit starts with a slow start from `initial_limit`: every successful response raises it by one, doubling
+        it per round of `limit` requests, until the latency of the last round exceeds SLOW_START_TOLERANCE times the
+        latency of the first one, a congestion signal, or `max_limit`. From then on every successful and fast response
+        raises it by 1 / limit, i.e. by one per round. A congestion signal (a recent error rate above
+        `max_error_rate`, or a smoothed latency of the last round above LATENCY_TOLERANCE times the long-run latency of
+        the last BASELINE_ROUNDS rounds) multiplies it by DECREASE_FACTOR, at most once per smoothed latency.
+        The latencies are geometric means over many requests, kept across decreases, so that the jitter of single
+        requests is not taken for congestion. The long-run latency catches a queue that builds up within a few rounds,
+        as at the end of the slow start; one growing over more than BASELINE_ROUNDS rounds is left to the error rate.
+
+        Args:
+            max_limit (int): The maximum number of concurrent requests.
+            min_limit (int): The minimum number of concurrent requests.
+            initial_limit (int): The starting number of concurrent requests.
+            max_error_rate (float): The error rate tolerated before backing off.
+            max_rate (Optional[float]): If given, the maximum number of requests started per second.
+            latency_signal (bool): Whether a rising latency signals congestion. Off when the latency does not come
+                from the host, e.g. through proxies of varying speed, where only the error rate counts.
+        """
+        self.max_limit = max_limit
+        self.min_limit = min(min_limit, max_limit)
+        self.limit = float(max(self.min_limit, min(initial_limit, max_limit)))
+        self.max_error_rate = max_error_rate
+        self.interval = 1 / max_rate if max_rate else 0
+        self.in_flight = 0
+        self.outcomes = deque(maxlen=OUTCOME_WINDOW)
+        self.latency_signal = latency_signal
+        self.slow_start = True
+        self.smoothed_latency = 0
+        self.baseline_latency = 0
+        self.latencies = 0
+        self.first_round = int(self.limit)
+        self.last_decrease = 0
+        self.next_start = 0
+        self.condition = None
+
+    async def acquire(self) -> None:
+        """Wait for a request slot, and for the rate limit if any. If cancelled, the slot is not taken."""
+        if self.condition is None:
+            self.condition = asyncio.Condition()
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+        if self.interval:
+            now = time.monotonic()
+            start, self.next_start = max(now, self.next_start), max(now, self.next_start) + self.interval
+            try:
+                await asyncio.sleep(start - now)
+            except asyncio.CancelledError:
+                # the caller does not get the slot, so it will not release it
+                await self._free()
+                raise
+
+    async def release(self, success: bool, latency: float) -> None:
+        """Free a request slot and adapt the limit to the outcome of the request.
+
+        Args:
+            success (bool): Whether the request succeeded.
+            latency (float): The duration of the request, in seconds.
+        """
+        self.outcomes.append(success)
+        if success:
+            # geometric means, which a few very slow requests do not drag up
+            latency = max(latency, MIN_LATENCY)
+            self.latencies += 1
+            if self.latencies == 1:
+                self.smoothed_latency = latency
+            self.smoothed_latency *= (latency / self.smoothed_latency) ** min(SMOOTHING, 1 / self.limit)
+            if self.latencies <= self.first_round:
+                # mean of the first round, at the initial load, the reference of the slow start
+                self.baseline_latency = self.baseline_latency ** (1 - 1 / self.latencies) * latency ** (
+                        1 / self.latencies)
+            elif not self.slow_start:
+                self.baseline_latency *= (latency / self.baseline_latency) ** (1 / (BASELINE_ROUNDS * self.limit))
+        error_rate = 1 - sum(self.outcomes) / len(self.outcomes)
+        slowdown = self.smoothed_latency / self.baseline_latency if (
+                success and self.latency_signal and self.baseline_latency > 0) else 1
+        congested = error_rate > self.max_error_rate or slowdown > LATENCY_TOLERANCE
+        if self.slow_start and slowdown > SLOW_START_TOLERANCE:
+            # the queue starts to grow: keep the limit, and raise it by one per round from now on
+            self.slow_start = False
+        now = time.monotonic()
+        if congested and now - self.last_decrease > self.smoothed_latency:
+            self.limit = max(self.min_limit, self.limit * DECREASE_FACTOR)
+            self.last_decrease = now
+            self.slow_start = False
+        elif success and not congested:
+            self.limit = min(self.max_limit, self.limit + (1 if self.slow_start else 1 / self.limit))
+            if self.slow_start and self.limit >= self.max_limit:
+                # the host kept up with the full load: its latency there is the reference from now on
+                self.slow_start = False
+                self.baseline_latency = self.smoothed_latency
+        await self._free()
+
+    async def _free(self) -> None:
+        async with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+
+class FetchMetrics(object):
+    def __init__(self) -> None:
+        """Initialize the counters of the downloads: in-flight requests, outcomes, bytes and latencies."""
+        self.start = time.monotonic()
+        self.in_flight = 0
+        self.successes = 0
+        self.failures = 0
+        self.retries = 0
+        self.bytes = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+
+    def request_started(self) -> None:
+        self.in_flight += 1
+
+    def request_finished(self, buffer: Optional[bytes], latency: float) -> None:
+        self.in_flight -= 1
+        self.latencies.append(latency)
+        if buffer is None:
+            self.failures += 1
+        else:
+            self.successes += 1
+            self.bytes += len(buffer)
+
+    def snapshot(self) -> Dict[str, float]:
+        """Returns the current metrics: in-flight requests, success rate, bytes per second, p50 and p99 latency."""
+        latencies = sorted(self.latencies)
+        requests = self.successes + self.failures
+        return {"in_flight": self.in_flight,
+                "requests": requests,
+                "retries": self.retries,
+                "success_rate": self.successes / requests if requests else 1.0,
+                "bytes_per_second": self.bytes / max(time.monotonic() - self.start, 1e-9),
+                "p50_latency": latencies[int(0.5 * (len(latencies) - 1))] if latencies else 0.0,
+                "p99_latency": latencies[int(0.99 * (len(latencies) - 1))] if latencies else 0.0}
+
+    def __str__(self) -> str:
+        metrics = self.snapshot()
+        return "{in_flight} in flight, {success_rate:.0%} ok, {rate:.1f} MB/s, p50 {p50:.2f}s, p99 {p99:.2f}s".format(
+            in_flight=metrics["in_flight"], success_rate=metrics["success_rate"],
+            rate=metrics["bytes_per_second"] / 1024 ** 2, p50=metrics["p50_latency"], p99=metrics["p99_latency"])
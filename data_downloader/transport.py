@@ -0,0 +1,248 @@
+import asyncio
+import os
+import time
+from abc import ABC, abstractmethod
+from queue import Queue
+from threading import Lock
+from typing import Optional, Tuple
+from urllib.parse import urlsplit
+
+import aiohttp
+import requests
+from aiohttp import ClientSession
+
+from cache import RawCache
+
+MIN_PROXY = 50
+
+PROXY_ULTRA_FAST_URL = "https://raw.githubusercontent.com/saschazesiger/Free-Proxies/master/proxies/ultrafast.txt"
+PROXY_FAST_URL = "https://raw.githubusercontent.com/saschazesiger/Free-Proxies/master/proxies/fast.txt"
+PROXY_HTTP_URL = "https://raw.githubusercontent.com/saschazesiger/Free-Proxies/master/proxies/http.txt"
+PROXY_ANONYMOUS = 'https://raw.githubusercontent.com/monosans/proxy-list/master/proxies_anonymous/http.txt'
+PROXY_HTTP_URL_2 = "https://raw.githubusercontent.com/TheSpeedX/SOCKS-List/master/http.txt"
+VALIDATE_URL = "https://www.google.com"
+MAX_CACHE_SIZE = 10_000
+ATTEMPTS = 50
+GET_MAX_WAITING_TIME = 2
+GET_GENERAL_COOLDOWN = 1
+MAX_THREAD_USAGE = 20
+MIN_THREAD_USAGE = -5  # imlpying each proxy have MIN_THREAD_USAGE continuous chance before been removing if error
+DATAFEED_URL = "http://datafeed.dukascopy.com/datafeed"
+
+# The proxy pool is shared by the proxy transports of the process. It is a plain dict: it is only used by the event
+# loop thread, so importing the module no longer starts a multiprocessing Manager process.
+working_proxies = {}
+recent_proxies = Queue(maxsize=MAX_CACHE_SIZE)
+update_proxies_lock = Lock()
+
+
+async def update_proxy():
+    """
+    Updates the pool of available proxy servers.
+    If the number of active proxies is less than the minimum threshold, it performs a "cold restart"
+    by waiting for other threads to finish, and then fetching a new set of proxy servers
+    from multiple sources and adding them to the working_proxies dictionary.
+    """
+    active_proxy = sum([1 for nbr_thread in working_proxies.values() if nbr_thread >= MIN_THREAD_USAGE])
+    if active_proxy > MIN_PROXY:
+        for proxy, nbr_thread in working_proxies.items():
+            if nbr_thread >= MIN_THREAD_USAGE and nbr_thread <= MAX_THREAD_USAGE:
+                recent_proxies.put_nowait(proxy)
+        for proxy in recent_proxies.queue:
+            working_proxies[proxy] += 1
+        if recent_proxies.qsize() == 0:
+            await asyncio.sleep(0.5)  # wait for a proxy to be released
+        return
+    # cold restart, we wait for other thread to finish otherwise could remove
+    await asyncio.sleep(
+        GET_MAX_WAITING_TIME + GET_GENERAL_COOLDOWN)  ## problem here need asyncio so other coroutine can be run
+    proxies = set()
+    # fetch proxy from different source
+    with requests.get(PROXY_ULTRA_FAST_URL) as response:
+        ultra_fast_proxy = response.text.split('\n')
+        proxies.update(ultra_fast_proxy)
+    with requests.get(PROXY_FAST_URL) as response:
+        fast_proxy = response.text.split('\n')
+        proxies.update(fast_proxy)
+    # for this source need to make sure the proxy is for http
+    with requests.get(PROXY_HTTP_URL) as response:
+        http_proxy = set(response.text.split('\n'))
+        proxies = proxies.intersection(http_proxy)
+    # with requests.get(PROXY_HTTP_URL_2) as response:
+    #    http_proxy = response.text.split('\n')
+    #    proxies.update(http_proxy)
+    with requests.get(PROXY_ANONYMOUS) as response:
+        anonymous_proxy = response.text.split("\n")
+        proxies.update(anonymous_proxy)
+    proxies = ['http://' + proxy for proxy in proxies]
+    for proxy in proxies:
+        working_proxies[proxy] = 0
+    await update_proxy()
+
+
+async def fetch_proxy():
+    """Fetch a new proxy from the proxy list.
+
+    Returns:
+        str: A new proxy URL.
+    """
+    while True:
+        if recent_proxies.qsize() > 0:
+            return recent_proxies.get()
+        else:
+            if update_proxies_lock.acquire(blocking=False):
+                await update_proxy()
+                update_proxies_lock.release()
+            else:
+                await asyncio.sleep(0)  # return to task manager so other work can be done
+
+
+class Transport(ABC):
+    """Fetches the raw payload of a data feed URL. One call to `get` is one attempt."""
+
+    # how many times DataFetcher tries a URL before giving up
+    attempts = ATTEMPTS
+    # error rate above which the host is considered overloaded
+    max_error_rate = 0.1
+    # whether a rising latency means that the host is overloaded
+    latency_signal = True
+
+    @abstractmethod
+    async def get(self, url: str) -> Optional[bytes]:
+        """Returns the payload of `url`, or None if this attempt failed."""
+
+    async def fetch(self, url: str) -> Tuple[Optional[bytes], float]:
+        """Returns the result of `get` and the duration of the request alone in seconds, which the concurrency is
+        adapted to. Transports doing other work before the request, as picking a proxy, exclude it."""
+        start = time.monotonic()
+        buffer = await self.get(url)
+        return buffer, time.monotonic() - start
+
+    def host(self, url: str) -> str:
+        """Returns the host actually serving `url`, which the concurrency is limited for."""
+        return urlsplit(url).netloc
+
+    def close(self) -> None:
+        pass
+
+    def status(self) -> str:
+        """Returns a short description of the transport state for the progress bar."""
+        return ""
+
+
+class DirectTransport(Transport):
+    def __init__(self, threads: int = 1000, base_url: str = DATAFEED_URL) -> None:
+        """Plain HTTP transport with a pooled connector, to the data feed or to an HTTP mirror of it.
+
+        Args:
+            threads (int): The maximum number of pooled connections.
+            base_url (str): The URL serving the `{symbol}/{year}/{month}/{day}_ticks.bi5` tree.
+        """
+        self.threads = threads
+        self.base_url = base_url.rstrip("/")
+        self.session = None
+
+    def _session(self) -> ClientSession:
+        # created lazily, from the running event loop
+        if self.session is None:
+            client_timeout = aiohttp.ClientTimeout(total=GET_MAX_WAITING_TIME)
+            connect = aiohttp.TCPConnector(limit=self.threads)
+            self.session = ClientSession(timeout=client_timeout, connector=connect)
+        return self.session
+
+    def _url(self, url: str) -> str:
+        return self.base_url + "/" + RawCache.key(url).replace(os.sep, "/")
+
+    def host(self, url: str) -> str:
+        return urlsplit(self.base_url).netloc
+
+    async def get(self, url: str, proxy: Optional[str] = None) -> Optional[bytes]:
+        async with self._session().get(self._url(url), proxy=proxy) as response:
+            if response.status == 200:
+                return await response.read()
+        return None
+
+    def close(self) -> None:
+        if self.session is not None:
+            asyncio.get_event_loop().run_until_complete(self.session.close())
+            self.session = None
+
+
+class ProxyTransport(DirectTransport):
+    """HTTP transport rotating over a pool of public proxies, to spread the requests to the data feed."""
+
+    # most failures come from dead proxies, not from the data feed
+    max_error_rate = 0.9
+    # the latency is the one of the proxy picked, not a load signal of the data feed
+    latency_signal = False
+
+    async def get(self, url: str, proxy: Optional[str] = None) -> Optional[bytes]:
+        buffer, _ = await self.fetch(url)
+        return buffer
+
+    async def fetch(self, url: str) -> Tuple[Optional[bytes], float]:
+        # refilling the proxy pool can take seconds, it is not part of the request latency
+        proxy = await fetch_proxy()
+        start = time.monotonic()
+        try:
+            buffer = await super().get(url, proxy=proxy)
+        except Exception:
+            working_proxies[proxy] -= 2
+            raise
+        latency = time.monotonic() - start
+        if buffer is None:
+            working_proxies[proxy] -= 2
+        else:
+            working_proxies[proxy] = working_proxies[proxy] - 1 if working_proxies[
+                                                                       proxy] > 0 else 0  # case for 2nd chance
+        return buffer, latency
+
+    def status(self) -> str:
+        return f'Used proxy {sum([1 for nbr_thread in working_proxies.values() if nbr_thread >= MIN_THREAD_USAGE])}'
+
+
+class MirrorTransport(Transport):
+    """Serves the payloads from a local `{symbol}/{year}/{month}/{day}_ticks.bi5` tree, e.g. a raw cache folder."""
+
+    # a missing file will not appear by asking again
+    attempts = 1
+
+    def host(self, url: str) -> str:
+        return self.folder
+
+    def __init__(self, folder: str) -> None:
+        """
+        Args:
+            folder (str): The root of the mirror.
+        """
+        self.folder = folder
+
+    async def get(self, url: str) -> Optional[bytes]:
+        path = os.path.join(self.folder, RawCache.key(url))
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as file:
+            return file.read()
+
+
+def get_transport(name: str, threads: int = 1000, mirror: Optional[str] = None) -> Transport:
+    """Returns the transport called `name`.
+
+    Args:
+        name (str): "proxy" (default data feed through public proxies), "direct" (data feed, or the HTTP mirror
+            `mirror` if given) or "mirror" (the local folder `mirror`).
+        threads (int): The maximum number of connections.
+        mirror (Optional[str]): The URL or folder of the mirror.
+
+    Returns:
+        Transport: The transport.
+    """
+    if name == "proxy":
+        return ProxyTransport(threads)
+    if name == "direct":
+        return DirectTransport(threads, mirror) if mirror is not None else DirectTransport(threads)
+    if name == "mirror":
+        if mirror is None:
+            raise ValueError("The mirror transport needs a mirror folder")
+        return MirrorTransport(mirror)
+    raise ValueError(f"Unknown transport {name}")
@@ -4,6 +4,7 @@ import os
 import signal
 import sys
 import time
+from contextlib import contextmanager
 from datetime import datetime, timedelta, date
 
 TEMPLATE = '%(asctime)s - %(levelname)s - %(threadName)s [%(thread)d] -  %(message)s'
@@ -44,6 +45,35 @@ def get_logger():
 Logger = get_logger()
 
 
+class NoInstrumentation(object):
+    """Stand-in for the instrumentation package of the repository, whose calls do nothing."""
+
+    def count(self, name, value=1):
+        pass
+
+    def observe(self, name, seconds):
+        pass
+
+    @contextmanager
+    def timer(self, name):
+        yield
+
+    def timed(self, name):
+        return lambda function: function
+
+
+def get_instrumentation():
+    # the package is at the root of the repository, on the path when the downloader runs from there
+    try:
+        import instrumentation
+    except ImportError:
+        return NoInstrumentation()
+    return instrumentation
+
+
+instrumentation = get_instrumentation()
+
+
 def set_up_signals():
     def signal_handler(signal, frame):
         sys.exit(0)
@@ -0,0 +1,2 @@
+from instrumentation.instruments import Registry, registry, enable, disable, count, observe, timer, timed, snapshot, \
+    export, reset
@@ -0,0 +1,177 @@
+import atexit
+import cProfile
+import json
+import os
+import re
+import time
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+from threading import Lock
+from typing import Dict, Optional
+
+# "1" turns on the timers and counters, "profile" also runs cProfile on every stage
+ENV_VARIABLE = "INSTRUMENT"
+# file where the summary is written at exit, in Prometheus text format if it ends with .prom, else in JSON
+ENV_OUTPUT = "INSTRUMENT_OUTPUT"
+PROMETHEUS_PREFIX = "fbd_"
+
+_DISABLED = nullcontext()
+
+
+class Registry(object):
+    def __init__(self, enabled: bool = False, profile: bool = False) -> None:
+        """Initialize a registry of named counters and timers.
+
+        When disabled, `timer` returns a shared no-op context manager and `count` returns immediately, so the
+        instrumented code pays one attribute check. With `profile`, the outermost running stage is also profiled
+        with cProfile, and the statistics of every stage are kept until `export`.
+
+        Args:
+            enabled (bool): Whether the counters and timers record anything.
+            profile (bool): Whether the stages are also profiled.
+        """
+        self.enabled = enabled or profile
+        self.profile = profile
+        self.lock = Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        """Forget every recorded value."""
+        self.counters: Dict[str, float] = {}
+        self.timers: Dict[str, list] = {}
+        self.profiles: Dict[str, cProfile.Profile] = {}
+        self.profiling = False
+
+    def count(self, name: str, value: float = 1) -> None:
+        """Add `value` to the counter `name`."""
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name: str, seconds: float) -> None:
+        """Record one duration of the stage `name`."""
+        if not self.enabled:
+            return
+        with self.lock:
+            stats = self.timers.get(name)
+            if stats is None:
+                self.timers[name] = [1, seconds, seconds, seconds]
+            else:
+                stats[0] += 1
+                stats[1] += seconds
+                stats[2] = min(stats[2], seconds)
+                stats[3] = max(stats[3], seconds)
+
+    def timer(self, name: str):
+        """Returns a context manager recording the duration of its block under the stage `name`."""
+        if not self.enabled:
+            return _DISABLED
+        return self._timer(name)
+
+    @contextmanager
+    def _timer(self, name: str):
+        profiler = self._start_profile(name) if self.profile else None
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+            if profiler is not None:
+                profiler.disable()
+                self.profiling = False
+
+    def _start_profile(self, name: str) -> Optional[cProfile.Profile]:
+        # a single profiler can run at a time, the nested and concurrent stages are part of the outer profile
+        with self.lock:
+            if self.profiling:
+                return None
+            self.profiling = True
+            profiler = self.profiles.setdefault(name, cProfile.Profile())
+        try:
+            profiler.enable()
+        except ValueError:
+            self.profiling = False
+            return None
+        return profiler
+
+    def timed(self, name: str):
+        """Decorator recording every call of the function under the stage `name`."""
+        def decorator(function):
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.timer(name):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def snapshot(self) -> Dict[str, dict]:
+        """Returns the counters, and the number of calls, total, mean, min and max seconds of every stage."""
+        with self.lock:
+            timers = {name: {"count": count, "total": total, "mean": total / count, "min": low, "max": high}
+                      for name, (count, total, low, high) in self.timers.items()}
+            return {"counters": dict(self.counters), "timers": timers}
+
+    def export(self, path: str) -> None:
+        """Write the summary to `path`, in Prometheus text format if it ends with .prom, else in JSON. The profiles
+        of the stages are written next to it as `{path}.{stage}.prof`, readable with pstats or snakeviz."""
+        snapshot = self.snapshot()
+        profiles = {}
+        for name, profiler in self.profiles.items():
+            profiles[name] = "{0}.{1}.prof".format(path, name)
+            profiler.dump_stats(profiles[name])
+        if path.endswith(".prom"):
+            text = self._prometheus(snapshot)
+        else:
+            snapshot["profiles"] = profiles
+            text = json.dumps(snapshot, indent=2) + "\n"
+        with open(path, "w") as file:
+            file.write(text)
+
+    @staticmethod
+    def _prometheus(snapshot: Dict[str, dict]) -> str:
+        lines = []
+        for name, value in sorted(snapshot["counters"].items()):
+            metric = PROMETHEUS_PREFIX + re.sub(r"\W", "_", name) + "_total"
+            lines += ["# TYPE {0} counter".format(metric), "{0} {1}".format(metric, value)]
+        for name, stats in sorted(snapshot["timers"].items()):
+            metric = PROMETHEUS_PREFIX + re.sub(r"\W", "_", name) + "_seconds"
+            lines += ["# TYPE {0} summary".format(metric),
+                      "{0}_count {1}".format(metric, stats["count"]),
+                      "{0}_sum {1}".format(metric, stats["total"]),
+                      "# TYPE {0}_max gauge".format(metric),
+                      "{0}_max {1}".format(metric, stats["max"])]
+        return "\n".join(lines) + "\n"
+
+
+def _from_env() -> Registry:
+    mode = os.getenv(ENV_VARIABLE, "").lower()
+    registry = Registry(enabled=mode not in ("", "0", "false", "off"), profile=mode == "profile")
+    output = os.getenv(ENV_OUTPUT)
+    if registry.enabled and output:
+        atexit.register(registry.export, output)
+    return registry
+
+
+registry = _from_env()
+
+
+def enable(profile: bool = False) -> None:
+    """Turn the instrumentation on, and the profiling of the stages with `profile`."""
+    registry.enabled = True
+    registry.profile = profile
+
+
+def disable() -> None:
+    """Turn the instrumentation off. The values recorded so far are kept."""
+    registry.enabled = False
+    registry.profile = False
+
+
+count = registry.count
+observe = registry.observe
+timer = registry.timer
+timed = registry.timed
+snapshot = registry.snapshot
+export = registry.export
+reset = registry.reset
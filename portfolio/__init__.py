@@ -0,0 +1 @@
+from portfolio.mvp import minimum_variance_portfolio, evaluate_portfolios, backtest
@@ -0,0 +1,89 @@
+from typing import Dict, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+def minimum_variance_portfolio(Sigma: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Minimum variance portfolio of every covariance matrix of a stack, without explicit inversion.
+    Args:
+       Sigma (ndarray): The covariance matrices (days, N, N), or a single one (N, N).
+    Returns:
+        ndarray : The weights w = Sigma^-1 e / (e' Sigma^-1 e), summing to 1 (days, N).
+        ndarray : The in-sample variance w' Sigma w of each portfolio (days,).
+    """
+    Sigma = np.asarray(Sigma, dtype=float)
+    single = Sigma.ndim == 2
+    Sigma = Sigma[None] if single else Sigma
+    w = np.linalg.solve(Sigma, np.ones(Sigma.shape[:-1])[..., None])[..., 0]
+    w /= w.sum(axis=1, keepdims=True)
+    variance = np.einsum('di,dij,dj->d', w, Sigma, w)
+    return (w[0], variance[0]) if single else (w, variance)
+
+
+def evaluate_portfolios(w: np.ndarray, returns: np.ndarray, realized: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Out of sample performance of a sequence of portfolios, each held over one day.
+    Args:
+       w (ndarray): The weights of the portfolio held each day (days, N).
+       returns (ndarray): The returns of the assets over each day (days, N).
+       realized (ndarray): The realized covariance of the assets over each day (days, N, N).
+    Returns:
+        Dict[str, ndarray] : The daily portfolio returns ("return"), realized standard deviations ("std") and their
+            ratios ("ratio"), each of shape (days,).
+    """
+    portfolio_return = np.einsum('di,di->d', w, returns)
+    portfolio_std = np.sqrt(np.einsum('di,dij,dj->d', w, realized, w))
+    return {"return": portfolio_return, "std": portfolio_std, "ratio": portfolio_return / portfolio_std}
+
+
+def backtest(estimates: Dict[str, np.ndarray], returns: np.ndarray, realized: np.ndarray,
+             lag: int = 1) -> Tuple[pd.DataFrame, Dict[str, Dict[str, np.ndarray]]]:
+    """
+    Compare cleaning methods by the minimum variance portfolios built from their covariance estimates.
+
+    The portfolio built from the estimate of day t is held over day t + lag, and evaluated on the returns and the
+    realized covariance of that day. Days where an estimate is missing (NaN, e.g. before the first full window of
+    a rolling method) or singular are left out of the summary of that method.
+    Args:
+       estimates (Dict[str, ndarray]): The covariance estimates of each method, e.g. {"raw": ..., "BAHC": ...,
+           "AO": ..., "RIE": ...}, each aligned on the same days (days, N, N).
+       returns (ndarray): The returns of the assets over each day (days, N).
+       realized (ndarray): The realized covariance of the assets over each day (days, N, N).
+       lag (int): The number of days between an estimate and the day its portfolio is held.
+    Returns:
+        DataFrame : One row per method with the mean out of sample return and standard deviation, the ratio of the
+            means, the mean and standard deviation of the daily ratios, the mean in-sample variance and the mean
+            difference between the realized and the in-sample variance.
+        Dict[str, Dict[str, ndarray]] : The daily weights, in-sample variances, returns, standard deviations and
+            ratios of each method, indexed by the day the portfolio is held (days - lag,).
+    """
+    returns, realized = returns[lag:], realized[lag:]
+    rows, details = {}, {}
+    for name, Sigma in estimates.items():
+        Sigma = np.asarray(Sigma, dtype=float)[:len(Sigma) - lag]
+        valid = np.isfinite(Sigma).all(axis=(1, 2))
+        w = np.full(Sigma.shape[:2], np.nan)
+        variance = np.full(len(Sigma), np.nan)
+        try:
+            w[valid], variance[valid] = minimum_variance_portfolio(Sigma[valid])
+        except np.linalg.LinAlgError:
+            # a singular day fails the whole batch, so only then solve the days one by one
+            for day in np.flatnonzero(valid):
+                try:
+                    w[day], variance[day] = minimum_variance_portfolio(Sigma[day])
+                except np.linalg.LinAlgError:
+                    pass
+        result = evaluate_portfolios(w, returns, realized)
+        result.update(weights=w, variance=variance)
+        details[name] = result
+        oos_return, oos_std = np.nanmean(result["return"]), np.nanmean(result["std"])
+        rows[name] = {"return": oos_return,
+                      "std": oos_std,
+                      "return/std": oos_return / oos_std,
+                      "mean ratio": np.nanmean(result["ratio"]),
+                      "std ratio": np.nanstd(result["ratio"]),
+                      "in-sample variance": np.nanmean(variance),
+                      "realized - in-sample variance": np.nanmean(result["std"]**2 - variance)}
+    return pd.DataFrame.from_dict(rows, orient='index'), details
@@ -0,0 +1,2 @@
+from preprocessing.returns import scan_ticks, scan_returns, tick_returns, daily_returns, returns_matrix
+from preprocessing.tick_index import TickIndex, TickView
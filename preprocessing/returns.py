@@ -0,0 +1,169 @@
+import os
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import polars as pl
+
+TIME = "time (UTC)"
+# days before `start` read for the last tick before it, from which the first return of `start` is measured
+ANCHOR_DAYS = 10
+
+
+def symbol_files(folder: str, symbols: Optional[List[str]] = None, start: Optional[date] = None,
+                 end: Optional[date] = None) -> List[Tuple[str, str]]:
+    """
+    List the Parquet files written by ParquetDumper in `folder`: files named {symbol}-{start}-{end}.parquet, or the
+    partitions symbol={symbol}/year={year}/month={month}/ of a partitioned dataset, of which only the months
+    overlapping the day range are kept.
+    Args:
+       folder (str): The folder holding the files, searched recursively.
+       symbols (Optional[List[str]]): If given, only the files of these symbols.
+       start (Optional[date]): If given, skip the partitions before the month of this day.
+       end (Optional[date]): If given, skip the partitions after the month of this day.
+    Returns:
+        List[Tuple[str, str]] : The symbol and the path of every file, sorted by path.
+    """
+    files = []
+    for root, dirs, names in os.walk(folder):
+        dirs[:] = [name for name in dirs if not name.startswith(".")]
+        keys = dict(part.split("=", 1) for part in os.path.relpath(root, folder).split(os.sep) if "=" in part)
+        if "year" in keys and "month" in keys:
+            month = (int(keys["year"]), int(keys["month"]))
+            if (start is not None and month < (start.year, start.month)) or \
+                    (end is not None and month > (end.year, end.month)):
+                continue
+        for name in names:
+            if name.endswith(".parquet") and not name.startswith("."):
+                symbol = keys.get("symbol", name.split("-")[0])
+                if symbols is None or symbol in symbols:
+                    files.append((symbol, os.path.join(root, name)))
+    return sorted(files, key=lambda file: file[1])
+
+
+def scan_ticks(folder: str, start: Optional[date] = None, end: Optional[date] = None,
+               symbols: Optional[List[str]] = None) -> pl.LazyFrame:
+    """
+    Lazily scan the ticks of every symbol of `folder` between two days.
+    The day range prunes the months of a partitioned dataset, and is a filter on the time column, so it is pushed down
+    to the Parquet reader, which skips the row groups outside of it from their statistics.
+    Args:
+       folder (str): The folder holding the files of ParquetDumper.
+       start (Optional[date]): The first day, included.
+       end (Optional[date]): The last day, included.
+       symbols (Optional[List[str]]): If given, only these symbols.
+    Returns:
+        LazyFrame : The ticks with a "symbol" column added, in time order within each symbol.
+    """
+    return pl.concat(list(_scan_symbols(folder, start, end, symbols).values()), how="vertical_relaxed")
+
+
+def _scan_symbols(folder: str, start: Optional[date], end: Optional[date],
+                  symbols: Optional[List[str]]) -> Dict[str, pl.LazyFrame]:
+    files = {}
+    for symbol, file in symbol_files(folder, symbols, start, end):
+        files.setdefault(symbol, []).append(file)
+    if not files:
+        raise FileNotFoundError("No Parquet file in {0}".format(folder))
+    scans = {}
+    for symbol, paths in files.items():
+        frames = []
+        for file in paths:
+            ticks = pl.scan_parquet(file, hive_partitioning=False)
+            if start is not None:
+                ticks = ticks.filter(pl.col(TIME) >= datetime.combine(start, datetime.min.time()))
+            if end is not None:
+                ticks = ticks.filter(pl.col(TIME) < datetime.combine(end + timedelta(1), datetime.min.time()))
+            frames.append(ticks)
+        ticks = pl.concat(frames, how="vertical_relaxed").with_columns(symbol=pl.lit(symbol))
+        # the months of a partitioned dataset follow each other in path order, while the numbered top-up files of a
+        # run hold days in between the days of the first file
+        if len(paths) > 1 and not all("month=" in file for file in paths):
+            ticks = ticks.sort(TIME, maintain_order=True)
+        scans[symbol] = ticks
+    return scans
+
+
+def _log_return() -> pl.Expr:
+    return ((pl.col("ask") + pl.col("bid")) / 2).log().diff()
+
+
+def tick_returns(ticks: pl.LazyFrame) -> pl.LazyFrame:
+    """
+    Mid price log returns of every symbol, as df_preprocessing in the notebook: mid = (ask + bid) / 2, the log
+    return between consecutive ticks, and the ticks where the mid does not move are dropped.
+    Args:
+       ticks (LazyFrame): The ticks of scan_ticks, in time order within each symbol.
+    Returns:
+        LazyFrame : The columns "symbol", "time (UTC)" and "logret".
+    """
+    return (ticks.select("symbol", TIME, logret=_log_return().over("symbol"))
+            .filter(pl.col("logret") != 0))
+
+
+def scan_returns(folder: str, start: Optional[date] = None, end: Optional[date] = None,
+                 symbols: Optional[List[str]] = None) -> pl.LazyFrame:
+    """
+    Lazily compute the mid price log returns (tick_returns) of every symbol of `folder` between two days.
+    The returns are computed on the ticks of each symbol on their own, across all its files, and then concatenated,
+    so that the query needs neither a sort nor a window over all the symbols and streams. The ticks are read from
+    ANCHOR_DAYS days before `start`, so that the first return of `start` is measured from the last tick before it,
+    as without a day range, unless the symbol did not trade in these days.
+    Args:
+       folder (str): The folder holding the files of ParquetDumper.
+       start (Optional[date]): The first day, included.
+       end (Optional[date]): The last day, included.
+       symbols (Optional[List[str]]): If given, only these symbols.
+    Returns:
+        LazyFrame : The columns "symbol", "time (UTC)" and "logret".
+    """
+    anchor = start - timedelta(ANCHOR_DAYS) if start is not None else None
+    returns = pl.concat([ticks.select("symbol", TIME, logret=_log_return()).filter(pl.col("logret") != 0)
+                         for ticks in _scan_symbols(folder, anchor, end, symbols).values()])
+    if start is not None:
+        returns = returns.filter(pl.col(TIME) >= datetime.combine(start, datetime.min.time()))
+    return returns
+
+
+def daily_returns(folder: str, start: Optional[date] = None, end: Optional[date] = None,
+                  symbols: Optional[List[str]] = None) -> pl.LazyFrame:
+    """
+    Daily aggregates of the mid price log returns of every symbol (scan_returns), in one lazy query.
+    Args:
+       folder (str): The folder holding the files of ParquetDumper.
+       start (Optional[date]): The first day, included.
+       end (Optional[date]): The last day, included.
+       symbols (Optional[List[str]]): If given, only these symbols.
+    Returns:
+        LazyFrame : One row per symbol and day with the summed log return ("logret"), the simple return
+            ("return" = exp(logret) - 1), the realized variance ("realized_variance", sum of the squared log returns)
+            and the number of returns ("ticks"), sorted by symbol and date.
+    """
+    returns = scan_returns(folder, start, end, symbols)
+    return (returns
+            .group_by("symbol", pl.col(TIME).dt.date().alias("date"))
+            .agg(logret=pl.col("logret").sum(),
+                 realized_variance=(pl.col("logret") ** 2).sum(),
+                 ticks=pl.len())
+            .with_columns(**{"return": pl.col("logret").exp() - 1})
+            .sort("symbol", "date"))
+
+
+def returns_matrix(folder: str, start: Optional[date] = None, end: Optional[date] = None,
+                   symbols: Optional[List[str]] = None, value: str = "return") -> pl.DataFrame:
+    """
+    Wide matrix of daily returns, one column per symbol, on the days every symbol traded (the inner merge of the
+    notebook). The query runs on the streaming engine, so the ticks are never all in memory, and uses every core.
+    Args:
+       folder (str): The folder holding the files of ParquetDumper.
+       start (Optional[date]): The first day, included.
+       end (Optional[date]): The last day, included.
+       symbols (Optional[List[str]]): If given, only these symbols, in this column order. By default every symbol,
+           sorted.
+       value (str): The daily aggregate to spread, see daily_returns.
+    Returns:
+        DataFrame : A "date" column and one column per symbol, sorted by date.
+    """
+    daily = daily_returns(folder, start, end, symbols).select("symbol", "date", value).collect(engine="streaming")
+    wide = daily.pivot(on="symbol", index="date", values=value).drop_nulls().sort("date")
+    columns = symbols if symbols is not None else sorted(c for c in wide.columns if c != "date")
+    return wide.select(["date"] + list(columns))
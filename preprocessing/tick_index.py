@@ -0,0 +1,210 @@
+from datetime import date
+from typing import List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import polars as pl
+
+from preprocessing.returns import TIME, scan_returns
+
+DAY_NS = 86400 * 10 ** 9
+
+
+def _day_ns(day: Union[date, np.datetime64, str]) -> int:
+    return int(np.datetime64(day, "D").astype("datetime64[ns]").view(np.int64))
+
+
+def _time_ns(time) -> int:
+    return int(np.datetime64(time, "ns").view(np.int64))
+
+
+class TickIndex(object):
+    def __init__(self, symbols: Sequence[str], times: Sequence[np.ndarray], values: Sequence[np.ndarray]) -> None:
+        """Initialize an index of the log returns of many assets, built once and sliced by day or window for free.
+
+        The timestamps of all assets are stored back to back (CSR style), with a table of the offsets of every day of
+        every asset, so that a day of all assets is N slices. The merged event grid of all assets and the pointers to
+        the last tick of every asset at each grid time are built on first use, and a window of the grid is again a
+        slice. The estimators then work on views of these arrays instead of DataFrames.
+
+        Args:
+            symbols (Sequence[str]): The name of every asset.
+            times (Sequence[np.ndarray]): The int64 nanosecond timestamps of the returns of every asset. Returns sharing
+                a timestamp are summed.
+            values (Sequence[np.ndarray]): The log returns of every asset, of the same lengths.
+        """
+        self.symbols = list(symbols)
+        merged_times, merged_values = [], []
+        for t, v in zip(times, values):
+            t, v = np.asarray(t, dtype=np.int64), np.asarray(v, dtype=float).reshape(-1)
+            order = np.argsort(t, kind="stable")
+            t, v = t[order], v[order]
+            t, start = np.unique(t, return_index=True)
+            if len(t) != len(order):
+                v = np.add.reduceat(v, start)
+            merged_times.append(t)
+            merged_values.append(v)
+        self.offsets = np.cumsum([0] + [len(t) for t in merged_times])
+        self.all_times = np.concatenate(merged_times) if merged_times else np.zeros(0, dtype=np.int64)
+        self.all_values = np.concatenate(merged_values) if merged_values else np.zeros(0)
+        # views of every asset on the CSR arrays
+        self.times = [self.all_times[lo:hi] for lo, hi in zip(self.offsets[:-1], self.offsets[1:])]
+        self.values = [self.all_values[lo:hi] for lo, hi in zip(self.offsets[:-1], self.offsets[1:])]
+
+        days = np.unique(self.all_times // DAY_NS)
+        self.days = days.astype("datetime64[D]")
+        bounds = np.append(days, days[-1] + 1 if len(days) else 0) * DAY_NS
+        # day_offsets[a, d] is the first tick of asset a at day d, within the ticks of a
+        self.day_offsets = np.array([np.searchsorted(t, bounds) for t in self.times]).reshape(len(self.times), -1)
+        self._bounds = bounds
+        self._grid = None
+
+    @classmethod
+    def from_parquet(cls, folder: str, start: Optional[date] = None, end: Optional[date] = None,
+                     symbols: Optional[List[str]] = None) -> "TickIndex":
+        """Build the index of the mid price log returns (scan_returns) of the files of ParquetDumper in `folder`.
+
+        Args:
+            folder (str): The folder holding the files of ParquetDumper.
+            start (Optional[date]): The first day, included.
+            end (Optional[date]): The last day, included.
+            symbols (Optional[List[str]]): If given, only these symbols, in this order. By default every symbol,
+                sorted.
+        Returns:
+            TickIndex : The index, with one asset per symbol.
+        """
+        returns = (scan_returns(folder, start, end, symbols)
+                   .select("symbol", pl.col(TIME).dt.epoch("ns").alias("ns"), "logret")
+                   .sort("symbol", "ns")
+                   .collect(engine="streaming"))
+        partitions = returns.partition_by("symbol", as_dict=True, include_key=False)
+        found = {key[0]: frame for key, frame in partitions.items()}
+        names = symbols if symbols is not None else sorted(found)
+        empty = pl.DataFrame({"ns": [], "logret": []}, schema={"ns": pl.Int64, "logret": pl.Float64})
+        frames = [found.get(name, empty) for name in names]
+        return cls(names, [f["ns"].to_numpy() for f in frames], [f["logret"].to_numpy() for f in frames])
+
+    @classmethod
+    def from_frames(cls, x, symbols: Optional[Sequence[str]] = None) -> "TickIndex":
+        """Build the index of the single column log return frames indexed by time, given to filterCovariance.
+
+        Args:
+            x (list[pd.DataFrame]): The log returns of every asset.
+            symbols (Optional[Sequence[str]]): The name of every asset, by default their position.
+        Returns:
+            TickIndex : The index.
+        """
+        times = [frame.index.values.astype("datetime64[ns]").view(np.int64) for frame in x]
+        values = [np.asarray(frame.to_numpy(), dtype=float)[:, 0] for frame in x]
+        return cls(symbols if symbols is not None else [str(a) for a in range(len(x))], times, values)
+
+    @property
+    def grid(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """The merged event grid (G,), the index of the last tick of every asset at or before every grid time, -1
+        before its first tick (G, N), and whether the asset ticks at the grid time (G, N), as align. Built once, in
+        G x N x 9 bytes."""
+        return self._grid_arrays()[:3]
+
+    def _grid_arrays(self):
+        if self._grid is None:
+            grid = np.unique(self.all_times)
+            ptr = np.empty((len(grid), len(self.times)), dtype=np.int64)
+            tick = np.zeros((len(grid), len(self.times)), dtype=bool)
+            for a, t in enumerate(self.times):
+                ptr[:, a] = np.searchsorted(t, grid, side="right") - 1
+                tick[np.searchsorted(grid, t), a] = True
+            # first grid time of every day
+            self._grid = grid, ptr, tick, np.searchsorted(grid, self._bounds)
+        return self._grid
+
+    def day(self, day: Union[int, date, str]) -> "TickView":
+        """The ticks of every asset at a day, given by its position in `days` or by its date, from the offset tables.
+
+        Args:
+            day (Union[int, date, str]): The position of the day, negative positions counting from the end, or the day.
+        Returns:
+            TickView : The view of the day.
+        Raises:
+            TypeError: If the day is a bool.
+            IndexError: If the position is out of range.
+            KeyError: If there is no tick at the day.
+        """
+        if isinstance(day, (bool, np.bool_)):
+            raise TypeError("A day is a position or a date, not a bool")
+        if not isinstance(day, (int, np.integer)):
+            position = np.searchsorted(self.days, np.datetime64(day, "D"))
+            if position == len(self.days) or self.days[position] != np.datetime64(day, "D"):
+                raise KeyError("No tick at {0}".format(day))
+            day = position
+        elif not -len(self.days) <= day < len(self.days):
+            raise IndexError("Day {0} is out of the {1} days of the index".format(day, len(self.days)))
+        elif day < 0:
+            day += len(self.days)
+        lo, hi = self.day_offsets[:, day], self.day_offsets[:, day + 1]
+        grid_offsets = self._grid_arrays()[3]
+        return TickView(self, lo, hi, grid_offsets[day], grid_offsets[day + 1])
+
+    def window(self, start, end) -> "TickView":
+        """The ticks of every asset between two times, both included as with .loc[start:end]. Unlike the partial string
+        indexing of pandas, a string is an exact time ("2021-01-05" is its midnight): see days_range for whole days.
+
+        Args:
+            start: The first time, anything np.datetime64 understands.
+            end: The last time.
+        Returns:
+            TickView : The view of the window.
+        """
+        start, end = _time_ns(start), _time_ns(end)
+        lo = np.array([np.searchsorted(t, start, side="left") for t in self.times])
+        hi = np.array([np.searchsorted(t, end, side="right") for t in self.times])
+        grid = self.grid[0]
+        return TickView(self, lo, hi, np.searchsorted(grid, start, side="left"),
+                        np.searchsorted(grid, end, side="right"))
+
+    def days_range(self, first: Union[date, str], last: Union[date, str]) -> "TickView":
+        """The ticks of every asset from the start of `first` to the end of `last`, both days included."""
+        return self.window(np.datetime64(_day_ns(first), "ns"), np.datetime64(_day_ns(last) + DAY_NS - 1, "ns"))
+
+
+class TickView(object):
+    def __init__(self, index: TickIndex, lo: np.ndarray, hi: np.ndarray, grid_lo: int, grid_hi: int) -> None:
+        """Initialize a view of a time range of a TickIndex: the ticks lo[a]:hi[a] of every asset and the grid times
+        grid_lo:grid_hi. Nothing is copied until the pointers are asked for."""
+        self.index = index
+        self.lo, self.hi = lo, hi
+        self.grid_lo, self.grid_hi = grid_lo, grid_hi
+
+    @property
+    def times(self) -> List[np.ndarray]:
+        return [t[lo:hi] for t, lo, hi in zip(self.index.times, self.lo, self.hi)]
+
+    @property
+    def values(self) -> List[np.ndarray]:
+        return [v[lo:hi] for v, lo, hi in zip(self.index.values, self.lo, self.hi)]
+
+    @property
+    def grid(self) -> np.ndarray:
+        return self.index.grid[0][self.grid_lo:self.grid_hi]
+
+    def aligned(self) -> Tuple[np.ndarray, np.ndarray]:
+        """The pointers of the window, relative to its first tick of every asset, -1 before it, and the tick flags,
+        equal to the output of align on the times of the view."""
+        _, ptr, tick = self.index.grid
+        return np.maximum(ptr[self.grid_lo:self.grid_hi] - self.lo, -1), tick[self.grid_lo:self.grid_hi]
+
+    def covariance(self) -> np.ndarray:
+        """Hayashi-Yoshida covariance matrix of the view (N, N), as covariance_matrix_Hayashi_Yoshida."""
+        # imported here so that the index does not need the clustering dependencies of the package
+        from bahc_1_9_tick_cov.hayashi_yoshida import hy_from_aligned
+
+        return hy_from_aligned(*self.aligned(), [v[:, None] for v in self.values])[0]
+
+    def realized_variance(self) -> np.ndarray:
+        """Sum of the squared log returns of every asset (N,)."""
+        return np.array([np.dot(v, v) for v in self.values])
+
+    def filter_covariance(self, **kwargs) -> np.ndarray:
+        """filterCovariance of the view, reusing the alignment of the index. See filterCovariance for the arguments."""
+        from bahc_1_9_tick_cov.main import _filter_covariance_arrays
+
+        return _filter_covariance_arrays(self.times, [v[:, None] for v in self.values], aligned=self.aligned(),
+                                         **kwargs)
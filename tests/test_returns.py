@@ -0,0 +1,51 @@
+import os
+from datetime import date, datetime
+
+import numpy as np
+import polars as pl
+import pytest
+from polars.testing import assert_frame_equal
+
+from preprocessing.returns import daily_returns
+
+SYMBOLS = ("AAA", "BBB")
+
+
+def _ticks(seed: int) -> pl.DataFrame:
+    """Ticks every 11 minutes from 2020-01-30 to 2020-02-02, across a month boundary and a weekend."""
+    times = pl.datetime_range(datetime(2020, 1, 30), datetime(2020, 2, 2), "11m", eager=True)
+    mid = np.exp(np.cumsum(np.random.default_rng(seed).normal(0, 1e-3, len(times))))
+    return pl.DataFrame({"time (UTC)": times, "ask": mid * 1.0001, "bid": mid * 0.9999})
+
+
+@pytest.fixture(params=["flat", "partitioned", "top-up"])
+def folder(request, tmp_path):
+    """The same ticks in the three layouts written by ParquetDumper."""
+    for seed, symbol in enumerate(SYMBOLS):
+        ticks = _ticks(seed)
+        if request.param == "flat":
+            ticks.write_parquet(tmp_path / "{0}-2020_01_30-2020_02_02.parquet".format(symbol))
+        elif request.param == "partitioned":
+            for month in (1, 2):
+                partition = tmp_path / "symbol={0}".format(symbol) / "year=2020" / "month={0:02d}".format(month)
+                os.makedirs(partition)
+                ticks.filter(pl.col("time (UTC)").dt.month() == month).write_parquet(partition / "data.parquet")
+        else:
+            # the 2020-01-31 download failed in the first run and came in a numbered file of the next one
+            failed = pl.col("time (UTC)").dt.date() == date(2020, 1, 31)
+            ticks.filter(~failed).write_parquet(tmp_path / "{0}-2020_01_30-2020_02_02.parquet".format(symbol))
+            ticks.filter(failed).write_parquet(tmp_path / "{0}-2020_01_30-2020_02_02-1.parquet".format(symbol))
+    return str(tmp_path)
+
+
+def test_daily_returns_do_not_depend_on_the_layout(folder, tmp_path_factory):
+    flat = tmp_path_factory.mktemp("flat")
+    for seed, symbol in enumerate(SYMBOLS):
+        _ticks(seed).write_parquet(flat / "{0}-2020_01_30-2020_02_02.parquet".format(symbol))
+    assert_frame_equal(daily_returns(folder).collect(), daily_returns(str(flat)).collect())
+
+
+@pytest.mark.parametrize("start", [date(2020, 1, 31), date(2020, 2, 1)])
+def test_daily_returns_keep_the_first_return_of_the_start_day(folder, start):
+    everything = daily_returns(folder).collect().filter(pl.col("date") >= start)
+    assert_frame_equal(daily_returns(folder, start=start).collect(), everything)
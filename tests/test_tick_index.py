@@ -0,0 +1,39 @@
+from datetime import date
+
+import numpy as np
+import pytest
+
+from preprocessing.tick_index import DAY_NS, TickIndex
+
+
+@pytest.fixture
+def index():
+    """Two assets over three days, the second one not trading on the second day."""
+    times = [np.array([1, DAY_NS + 5, 2 * DAY_NS + 3]), np.array([2, 2 * DAY_NS + 7])]
+    values = [np.array([0.1, 0.2, 0.3]), np.array([0.4, 0.5])]
+    return TickIndex(["a", "b"], times, values)
+
+
+@pytest.mark.parametrize("position, expected", [(0, [[0.1], [0.4]]), (1, [[0.2], []]), (2, [[0.3], [0.5]]),
+                                                (-1, [[0.3], [0.5]]), (-3, [[0.1], [0.4]]),
+                                                (np.int64(-2), [[0.2], []])])
+def test_day_by_position(index, position, expected):
+    assert [list(v) for v in index.day(position).values] == expected
+
+
+def test_day_by_date(index):
+    assert [list(v) for v in index.day(date(1970, 1, 2)).values] == [[0.2], []]
+    with pytest.raises(KeyError):
+        index.day("1970-01-05")
+
+
+@pytest.mark.parametrize("position", [3, -4, 100])
+def test_day_out_of_range(index, position):
+    with pytest.raises(IndexError):
+        index.day(position)
+
+
+@pytest.mark.parametrize("flag", [True, False, np.bool_(True)])
+def test_day_rejects_bool(index, flag):
+    with pytest.raises(TypeError):
+        index.day(flag)